@@ -0,0 +1,233 @@
+import cProfile
+import contextlib
+import errno
+import heapq
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Sync runs are only profiled when this is set, profiling every entry slows
+# the run down
+PROFILE_ENABLED = getattr(settings, 'SHOTGUN_PROFILE', False)
+
+# Profiles go in a directory per run under here, by default next to the
+# file the run logs to
+PROFILE_DIR = getattr(settings, 'SHOTGUN_PROFILE_DIR', None)
+
+# Seconds between samples of every thread's stack
+PROFILE_INTERVAL = getattr(settings, 'SHOTGUN_PROFILE_INTERVAL', 0.01)
+
+# Number of the slowest entries whose own profiles are kept
+PROFILE_SLOWEST = getattr(settings, 'SHOTGUN_PROFILE_SLOWEST', 10)
+
+
+def _run_log_dir():
+    """
+    Directory of the first file the run logs to, the temp directory if it
+    only logs to streams
+    """
+    for log in (logging.getLogger('shotgun'), logging.getLogger()):
+        for handler in log.handlers:
+            filename = getattr(handler, 'baseFilename', None)
+            if filename:
+                return os.path.join(os.path.dirname(filename), 'profiles')
+    return os.path.join(tempfile.gettempdir(), 'shotgun_profiles')
+
+
+class StackSampler(object):
+    """
+    Samples the stack of every thread at a fixed interval from a thread of
+    its own. The counts are written in the collapsed stack format that
+    flamegraph.pl and speedscope read, one line per distinct stack.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._counts = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            names = dict(
+                (thread.ident, thread.name) for thread in threading.enumerate()
+            )
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%s)' % (
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno
+                    ))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(stack))
+                self._counts[key] = self._counts.get(key, 0) + 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self._counts.items()):
+                f.write('%s %s\n' % (stack, count))
+
+
+class RunProfiler(object):
+    """
+    Profiles a sync run, when enabled. The whole run is sampled by a
+    StackSampler and each entry run inside entry() is profiled with
+    cProfile, keeping the profiles of the slowest entries. Stopping writes
+    to a directory of its own:
+
+    stacks.collapsed  sampled stacks of every thread, for a flame graph
+    summary.txt       wall and CPU time of the run and the slowest entries
+    <entry>.prof      cProfile stats of each of the slowest entries
+
+    Does nothing at all when not enabled, so the drivers can always use it.
+    """
+
+    def __init__(self, name, enabled=None, directory=None,
+                 interval=PROFILE_INTERVAL, slowest=PROFILE_SLOWEST):
+        self.name = name
+        self.enabled = PROFILE_ENABLED if enabled is None else enabled
+        self.directory = directory or PROFILE_DIR or _run_log_dir()
+        self.slowest = slowest
+        self.path = None
+        self._sampler = StackSampler(interval)
+        # Heap of (seconds, sequence, entry name, profile) of the slowest
+        self._entries = []
+        self._entry_count = 0
+        self._lock = threading.Lock()
+        self._started = None
+        self._cpu_started = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def _cpu_time():
+        times = os.times()
+        return times[0] + times[1]
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._started = time.time()
+        self._cpu_started = self._cpu_time()
+        self._sampler.start()
+
+    @contextlib.contextmanager
+    def entry(self, name):
+        """
+        Profile the work of one entry, or one task of it
+        :param name: entry number or task name, used for the file name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Some interpreters only allow one profile active at a time
+            profile = None
+        started = time.time()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._keep(time.time() - started, name, profile)
+
+    def _keep(self, seconds, name, profile):
+        with self._lock:
+            self._entry_count += 1
+            item = (seconds, self._entry_count, name, profile)
+            if len(self._entries) < self.slowest:
+                heapq.heappush(self._entries, item)
+            else:
+                heapq.heappushpop(self._entries, item)
+
+    def stop(self):
+        """
+        Stop sampling and write out the profiles. Profiling must never fail
+        the run, so errors writing them are only logged.
+        :return: directory the profiles were written to, None if they
+            could not be written
+        """
+        if not self.enabled or self._started is None:
+            return None
+        self._sampler.stop()
+        wall = time.time() - self._started
+        cpu = self._cpu_time() - self._cpu_started
+        self._started = None
+
+        try:
+            self._write(wall, cpu)
+        except Exception:
+            logger.exception('Could not write the profile of %s' % self.name)
+            self.path = None
+        finally:
+            self._entries = []
+        return self.path
+
+    def _write(self, wall, cpu):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Unique even for runs of the same name started in the same second
+        self.path = tempfile.mkdtemp(
+            prefix='%s-%s-' % (
+                re.sub(r'[^\w.-]+', '_', self.name),
+                time.strftime('%Y%m%d-%H%M%S')
+            ),
+            dir=self.directory
+        )
+
+        self._sampler.write(os.path.join(self.path, 'stacks.collapsed'))
+
+        lines = [
+            'run %s' % self.name,
+            'wall seconds %.1f' % wall,
+            'cpu seconds %.1f' % cpu,
+            'samples %s every %ss'
+            % (self._sampler.samples, self._sampler.interval),
+            'entries profiled %s, slowest:' % self._entry_count,
+        ]
+        for seconds, _, name, profile in sorted(self._entries, reverse=True):
+            filename = '%s.prof' % re.sub(r'[^\w.-]+', '_', name)
+            profile.dump_stats(os.path.join(self.path, filename))
+            lines.append('%10.2fs  %s  %s' % (seconds, name, filename))
+
+        with open(os.path.join(self.path, 'summary.txt'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        logger.info('Profile of %s written to %s' % (self.name, self.path))
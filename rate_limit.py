@@ -0,0 +1,116 @@
+import random
+import socket
+import threading
+import time
+
+from django.conf import settings
+from shotgun_api3 import ProtocolError, ShotgunError
+
+# Requests per second to start at and the bounds the rate adapts within
+SHOTGUN_RATE_LIMIT = getattr(settings, 'SHOTGUN_RATE_LIMIT', 10.0)
+SHOTGUN_RATE_LIMIT_MIN = getattr(settings, 'SHOTGUN_RATE_LIMIT_MIN', 0.5)
+SHOTGUN_RATE_LIMIT_MAX = getattr(settings, 'SHOTGUN_RATE_LIMIT_MAX', 50.0)
+
+RETRY_ATTEMPTS = getattr(settings, 'SHOTGUN_RETRY_ATTEMPTS', 6)
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 60.0
+
+# Responses meaning the server did not process the request because of load
+THROTTLE_STATUSES = (429, 503)
+# Responses that may or may not have been processed
+TRANSIENT_STATUSES = (500, 502, 504)
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every request to shotgun. The rate adapts AIMD
+    style, it creeps up while requests succeed and halves whenever the
+    server throttles, settling at the fastest rate the server accepts.
+    """
+
+    def __init__(self, rate=SHOTGUN_RATE_LIMIT,
+                 min_rate=SHOTGUN_RATE_LIMIT_MIN,
+                 max_rate=SHOTGUN_RATE_LIMIT_MAX,
+                 increase=1.0, decrease=0.5):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = 1.0
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request may be sent
+        """
+        with self._lock:
+            now = time.time()
+            # Up to a second's worth of requests can go in a burst
+            self._tokens = min(
+                max(self.rate, 1.0),
+                self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Reserve a token, going into debt if there is none so later
+            # callers queue behind this one
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+    def succeeded(self):
+        with self._lock:
+            # Roughly `increase` more requests per second, every second
+            self.rate = min(
+                self.max_rate, self.rate + self.increase / self.rate
+            )
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+rate_limiter = RateLimiter()
+
+
+def is_throttle(error):
+    if isinstance(error, ProtocolError):
+        return error.errcode in THROTTLE_STATUSES
+    if isinstance(error, ShotgunError):
+        # Uploads only surface the status in the message
+        message = str(error)
+        return any(
+            'HTTP Error %s' % status in message for status in THROTTLE_STATUSES
+        )
+    return False
+
+
+def is_transient(error):
+    if isinstance(error, ProtocolError):
+        return error.errcode in TRANSIENT_STATUSES
+    return isinstance(error, socket.error)
+
+
+def retry_after(error):
+    """
+    :return: seconds the server asked us to wait, 0 if it did not say
+    """
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after', 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+def backoff(attempt):
+    """
+    Full jitter exponential backoff
+    :param attempt: number of attempts made so far
+    :return: seconds to wait before the next one
+    """
+    return random.uniform(
+        0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt)
+    )
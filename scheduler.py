@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Lanes in priority order, metadata first so vetters see submission
+# changes even while large proxies are transferring
+LANE_METADATA = 'metadata'
+LANE_SLATES = 'slates'
+LANE_SUPPLEMENTAL = 'supplemental'
+LANE_PROXIES = 'proxies'
+LANES = (LANE_METADATA, LANE_SLATES, LANE_SUPPLEMENTAL, LANE_PROXIES)
+
+SCHEDULER_WORKERS = getattr(settings, 'SHOTGUN_SCHEDULER_WORKERS', 8)
+
+# Most workers each lane may occupy at once. Lower lanes get less than the
+# total so some workers are always free for the lanes above them.
+LANE_WORKERS = getattr(settings, 'SHOTGUN_LANE_WORKERS', {
+    LANE_METADATA: 8,
+    LANE_SLATES: 4,
+    LANE_SUPPLEMENTAL: 2,
+    LANE_PROXIES: 3,
+})
+
+# Workers only the metadata lane may use, however busy the lanes below
+# it are, so submission changes never wait for a worker
+LANE_RESERVED_WORKERS = getattr(settings, 'SHOTGUN_LANE_RESERVED_WORKERS', 1)
+
+# A task waiting this long goes ahead of the lanes above its own
+LANE_MAX_WAIT_SECONDS = getattr(
+    settings, 'SHOTGUN_LANE_MAX_WAIT_SECONDS', 600
+)
+
+
+class Task(object):
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, lane, func, args, after, name):
+        self.lane = lane
+        self.func = func
+        self.args = args
+        self.after = after
+        self.name = name
+        self.status = self.PENDING
+        self.queued = time.time()
+        # When the last task it waits for finished, its wait is counted
+        # from then
+        self.ready = None
+        self.dependents = []
+        self.result = None
+
+    def __repr__(self):
+        return '<Task %s %s %s>' % (self.lane, self.name, self.status)
+
+
+class LaneScheduler(object):
+    """
+    Runs tasks on a pool of worker threads, always taking the next ready
+    task from the highest priority lane that is under its worker budget.
+    The lanes below the first share at most all but reserved of the
+    workers. A task ready for longer than max_wait is taken ahead of higher
+    lanes, so every lane keeps making progress. Tasks can wait for other
+    tasks with after and are skipped if one of those fails.
+
+    Each worker calls worker_init once and passes what it returns as the
+    first argument of every task it runs, e.g. a client of its own.
+    With a profiling.RunProfiler each task is profiled under its name.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, budgets=None,
+                 max_wait=LANE_MAX_WAIT_SECONDS, worker_init=None,
+                 worker_exit=None, profiler=None,
+                 reserved=LANE_RESERVED_WORKERS):
+        self.workers = workers
+        self.budgets = dict(LANE_WORKERS)
+        self.budgets.update(budgets or {})
+        self.max_wait = max_wait
+        # With a single worker the lower lanes still have to run
+        self.lower_lane_workers = max(1, workers - reserved)
+        self.worker_init = worker_init
+        self.worker_exit = worker_exit
+        self.profiler = profiler
+        self.tasks = []
+        self._pending = dict((lane, deque()) for lane in LANES)
+        self._running = dict((lane, 0) for lane in LANES)
+        self._condition = threading.Condition()
+
+    def add(self, lane, func, args=(), after=(), name=None):
+        """
+        Queue a task
+        :param lane: one of LANES
+        :param func: called as func(worker, *args)
+        :param args:
+        :param after: tasks that must finish first
+        :param name: for logging
+        :return: Task
+        """
+        task = Task(lane, func, args, list(after), name or func.__name__)
+        with self._condition:
+            for dependency in task.after:
+                dependency.dependents.append(task)
+            if all(dependency.status == Task.DONE
+                   for dependency in task.after):
+                task.ready = task.queued
+            self.tasks.append(task)
+            self._pending[lane].append(task)
+            self._condition.notify()
+        return task
+
+    def _first_ready(self, lane):
+        # Called with the lock held. Drops tasks whose dependencies failed.
+        pending = self._pending[lane]
+        for task in list(pending):
+            if any(
+                dependency.status in (Task.FAILED, Task.SKIPPED)
+                for dependency in task.after
+            ):
+                pending.remove(task)
+                task.status = Task.SKIPPED
+                self._condition.notify_all()
+                continue
+            if all(dependency.status == Task.DONE
+                   for dependency in task.after):
+                return task
+        return None
+
+    def _mark_ready(self, task):
+        # Called with the lock held when task is done
+        now = time.time()
+        for dependent in task.dependents:
+            if all(dependency.status == Task.DONE
+                   for dependency in dependent.after):
+                dependent.ready = now
+
+    def _next_task(self):
+        # Called with the lock held
+        now = time.time()
+        chosen = None
+        lower_lanes_full = sum(
+            self._running[lane] for lane in LANES[1:]
+        ) >= self.lower_lane_workers
+        for lane in LANES:
+            if self._running[lane] >= self.budgets.get(lane, self.workers):
+                continue
+            if lane != LANES[0] and lower_lanes_full:
+                continue
+            task = self._first_ready(lane)
+            if task is None:
+                continue
+            if chosen is None:
+                chosen = task
+            # Starved tasks go first, the longest ready of them
+            elif now - task.ready > self.max_wait and \
+                    task.ready < chosen.ready:
+                chosen = task
+
+        if chosen is not None:
+            self._pending[chosen.lane].remove(chosen)
+            self._running[chosen.lane] += 1
+            chosen.status = Task.RUNNING
+        return chosen
+
+    def _drained(self):
+        return not any(self._pending.values()) and \
+            not any(self._running.values())
+
+    def _work(self):
+        worker = self.worker_init() if self.worker_init else None
+        try:
+            while True:
+                with self._condition:
+                    task = self._next_task()
+                    while task is None:
+                        if self._drained():
+                            return
+                        self._condition.wait()
+                        task = self._next_task()
+
+                try:
+                    if self.profiler is not None:
+                        with self.profiler.entry(task.name):
+                            task.result = task.func(worker, *task.args)
+                    else:
+                        task.result = task.func(worker, *task.args)
+                    status = Task.DONE
+                except Exception:
+                    logger.exception('Task %s failed' % task.name)
+                    status = Task.FAILED
+
+                with self._condition:
+                    task.status = status
+                    if status == Task.DONE:
+                        self._mark_ready(task)
+                    self._running[task.lane] -= 1
+                    self._condition.notify_all()
+        finally:
+            if self.worker_exit:
+                self.worker_exit(worker)
+
+    def run(self):
+        """
+        Run until every task has finished
+        :return: the tasks
+        """
+        threads = [
+            threading.Thread(target=self._work) for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.tasks
@@ -37,10 +37,23 @@ from ves.awards.models import Entry, EntryFiles
 from ves.awards.views import genSlate
 from applications import models as app_models
 from sohonet_encode.movtool import MovFile
+from profiling import RunProfiler
+from shotgun_v2 import stream_entries
+from swift_transfer import (
+    CHUNK_SIZE, TransferIntegrityError, download_object, read_chunks
+)
 
-import operator
+import heapq
 import time
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 SHOTGUN_PROJECT_ID = settings.SHOTGUN_PROJECT_ID
 PROJECT_INFO = {'type': 'Project', 'id': SHOTGUN_PROJECT_ID}
 
@@ -85,28 +98,71 @@ def get_oldest_file(files, _invert=False):
     Use of `_invert` inverts logic to make this a youngest routine,
     to be used more clearly via `get_youngest_file`.
     """
-    gt = operator.lt if _invert else operator.gt
     # Check for empty list.
     if not files:
         return None
-    # Raw epoch distance.
-    now = time.time()
-    # Select first as arbitrary sentinel file, storing name and age.
-    oldest = files[0], now - os.path.getctime(files[0])
-    # Iterate over all remaining files.
-    for f in files[1:]:
-        age = now - os.path.getctime(f)
-        if gt(age, oldest[1]):
-            # Set new oldest.
-            oldest = f, age
-    # Return just the name of oldest file.
-    return oldest[0]
+    # One stat per file, every call. A file rewritten in place gets a new
+    # ctime without its directory changing, so ctimes can not be cached.
+    # min and max return the first of equal files.
+    select = max if _invert else min
+    return select(files, key=os.path.getctime)
 
 
 def get_youngest_file(files):
     return get_oldest_file(files, _invert=True)
 
 
+class DirectoryIndex(object):
+    """ Files of a directory ordered by ctime, for picking the oldest,
+    youngest or top k of a whole directory from one scandir pass.
+    Every pass stats every file again, since a file rewritten in place
+    changes its ctime but not the directory's mtime.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ctimes = {}
+
+    def refresh(self):
+        ctimes = {}
+        if scandir is not None:
+            for entry in scandir(self.path):
+                try:
+                    if entry.is_file():
+                        ctimes[entry.name] = entry.stat().st_ctime
+                except OSError:
+                    # Removed since the directory was read
+                    continue
+        else:
+            for name in os.listdir(self.path):
+                path = os.path.join(self.path, name)
+                try:
+                    if os.path.isfile(path):
+                        ctimes[name] = os.path.getctime(path)
+                except OSError:
+                    continue
+        self._ctimes = ctimes
+
+    def _ordered(self, count, youngest):
+        self.refresh()
+        names = heapq.nsmallest(
+            count, self._ctimes,
+            key=lambda name: (
+                -self._ctimes[name] if youngest else self._ctimes[name],
+                name
+            )
+        )
+        return [os.path.join(self.path, name) for name in names]
+
+    def oldest(self, count=1):
+        """ The `count` oldest files, oldest first. """
+        return self._ordered(count, youngest=False)
+
+    def youngest(self, count=1):
+        """ The `count` youngest files, youngest first. """
+        return self._ordered(count, youngest=True)
+
+
 def download_from_swift(upload_object, path):
     user_package = upload_object.application_user_package
     package = user_package.package
@@ -118,23 +174,15 @@ def download_from_swift(upload_object, path):
     full_path = u'%s/%s' % (container, obj_name)
     log('Downloading %s' % full_path)
     try:
-        connection.head_object(container, obj_name)
+        headers = connection.head_object(container, obj_name)
         log(u"Swift Object Exists %s" % full_path)
 
-        f = open(path, 'wb')
-        _, ob_contents = connection.get_object(
-            container=container,
-            obj=obj_name,
-            resp_chunk_size=(1024 * 1024 * 40))
-
-        for chunk in ob_contents:
-            f.write(chunk)
-
-        f.close()
+        # Packages are only needed once, so they skip the proxy cache
+        download_object(connection, container, obj_name, path, headers)
 
         log(u"Swift Download Complete %s" % full_path)
 
-    except ClientException as ce:
+    except (ClientException, TransferIntegrityError) as ce:
         log_exception(ce)
 
 # ShotgunVES wraps the shotgun API with helping methods specifically for the
@@ -603,9 +651,9 @@ class ShotgunVES:
                         _, ob_contents = connection.get_object(
                             settings.VES_PROXY_CONTAINER,
                             entry_mp4_name,
-                            resp_chunk_size=(1024 * 1024 * 40))
+                            resp_chunk_size=CHUNK_SIZE)
 
-                        for chunk in ob_contents:
+                        for chunk in read_chunks(ob_contents):
                             f.write(chunk)
                         f.close()
 
@@ -647,10 +695,10 @@ class ShotgunVES:
                             _, ob_contents = connection.get_object(
                                 settings.VES_THUMBS_CONTAINER,
                                 _entryThumbFilename,
-                                resp_chunk_size=(1024 * 1024 * 40)
+                                resp_chunk_size=CHUNK_SIZE
                             )
 
-                            for chunk in ob_contents:
+                            for chunk in read_chunks(ob_contents):
                                 f.write(chunk)
                             f.close()
 
@@ -715,9 +763,9 @@ class ShotgunVES:
                         _, ob_contents = connection.get_object(
                             settings.VES_PROXY_CONTAINER,
                             ba_mp4_name,
-                            resp_chunk_size=(1024 * 1024 * 40))
+                            resp_chunk_size=CHUNK_SIZE)
 
-                        for chunk in ob_contents:
+                        for chunk in read_chunks(ob_contents):
                             f.write(chunk)
                         f.close()
 
@@ -769,9 +817,9 @@ class ShotgunVES:
                 _, ob_contents = connection.get_object(
                     settings.VES_PDF_CONTAINER,
                     _pdfSupplmentalsFilename,
-                    resp_chunk_size=(1024 * 1024 * 40))
+                    resp_chunk_size=CHUNK_SIZE)
 
-                for chunk in ob_contents:
+                for chunk in read_chunks(ob_contents):
                     f.write(chunk)
                 f.close()
 
@@ -851,14 +899,18 @@ def shotgunUpdate(entry_id, updateEntryDetails=True, updateEntryMedia=True,
 
 def processShotgunUpdate():
     if settings.UPDATE_SHOTGUN:
-        entries = Entry.objects.all()
+        entries = stream_entries()
         log('Updating All Entries')
         shotgun = getShotgun()
-        for entry in entries:
-            try:
-                shotgun.createUpdateShotgunEntry(entry, True, False, False, False)
-                log('Updated %s' % entry)
-            except Exception:
-                log('Could not update %s' % entry)
+        with RunProfiler('processShotgunUpdate') as profiler:
+            for entry in entries:
+                try:
+                    with profiler.entry(str(entry.entryNum)):
+                        shotgun.createUpdateShotgunEntry(
+                            entry, True, False, False, False
+                        )
+                    log('Updated %s' % entry)
+                except Exception:
+                    log('Could not update %s' % entry)
     else:
         logger.warning('Not updating Shotgun')
@@ -1,27 +1,175 @@
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import re
+import shutil
 import tempfile
+import threading
+import time
 import utils
 
+import rate_limit
+import scheduler
+import swift_transfer
+
 from applications.models import ApplicationStorageLocation
 from django.conf import settings
+from django.db import connections
+from itertools import chain
+from multiprocessing.pool import ThreadPool
 from pprint import pformat
-from shotgun_api3 import Shotgun, ShotgunError
+from profiling import RunProfiler
+from shotgun_api3 import Shotgun, ShotgunError, sg_timezone
 from sohonet_encode.movtool import MovFile
 from swiftclient import ClientException
+from sync_state import entries_fingerprint, get_sync_state
 
-from ves.awards.models import EntryFiles
+from ves.awards.models import Entry, EntryFiles
 from ves.awards.views import genSlate
 
 SERVER_PATH = 'https://ves.shotgunstudio.com'
 MAIN_PROXY_NAME = settings.VES_MAIN_PROXY_NAME
 
+logger = logging.getLogger(__name__)
+
+# Everything the payload generators read off an entry
+ENTRY_RELATED_FIELDS = (
+    'entrant1', 'entrant2', 'entrant3', 'entrant4', 'entrant5',
+    'submittingEntrant', 'entrantVFX', 'entrantFacilityMgr',
+    'submissionContact', 'entryNum__category',
+)
+
+
+# Sync phases of an entry
+PHASE_DETAILS = 'details'
+PHASE_AA_MEDIA = 'aa_media'
+PHASE_BA_MEDIA = 'ba_media'
+PHASE_SUPPLEMENTAL = 'supplemental'
+ALL_PHASES = (
+    PHASE_DETAILS, PHASE_AA_MEDIA, PHASE_BA_MEDIA, PHASE_SUPPLEMENTAL
+)
+
+# Status of a withdrawn submission
+WITHDRAWN_STATUS = 'wdraw'
+
+# Most requests sent in one batch call or 'in' filter
+BATCH_SIZE = 100
+
+# Where poll_events keeps the id of the last event log entry it has seen
+EVENT_CURSOR_PATH = getattr(
+    settings, 'SHOTGUN_EVENT_CURSOR_PATH',
+    os.path.join(tempfile.gettempdir(), 'ves_shotgun_event_cursor')
+)
+EVENT_PAGE_SIZE = 500
+
+# Thumbnails are uploaded from memory through a temporary file, kept on
+# tmpfs where there is one
+THUMBNAIL_TEMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+THUMBNAIL_WORKERS = getattr(settings, 'SHOTGUN_THUMBNAIL_WORKERS', 8)
+
+# Plans needing at most this many objects from a container read their
+# sizes one at a time rather than listing the whole container
+PLAN_HEAD_LIMIT = 50
+
+# Versions are named after the md5 of their source media
+MD5_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# Shot fields holding the screening totals of a category's submissions.
+# They are not part of the stock Shot schema, add them as number fields on
+# the site before turning on CATEGORY_AGGREGATES. Without them the totals
+# are skipped with a warning.
+CATEGORY_AGGREGATE_FIELDS = [
+    'sg_submission_count', 'sg_total_run_time', 'sg_mean_run_time'
+]
+
+# Whether sync runs refresh the category totals once they are done
+CATEGORY_AGGREGATES = getattr(settings, 'SHOTGUN_CATEGORY_AGGREGATES', False)
+
+# Entry fields of each entrant slot, the entrant_dict keys the slot fills
+# and the submission fields they go to, formatted once rather than per entry
+ENTRANT_SLOTS = tuple(
+    (
+        n, 'entrant%s' % n, 'e%sjobTitleOrCredit' % n, 'e%sURL' % n,
+        'entrant_%s' % n, 'entrant_%s_job_title' % n, 'entrant_%s_url' % n,
+    )
+    for n in range(1, 6)
+)
+SUBMITTER_FIELDS = tuple(
+    (key, 'sg_submitter_%s%s' % (n, suffix))
+    for n in range(1, 6)
+    for key, suffix in (
+        ('entrant_%s' % n, ''),
+        ('entrant_%s_url' % n, '_url'),
+        ('entrant_%s_job_title' % n, '_job_title'),
+    )
+)
+
+# Submission fields that are the same for every entry
+SUBMISSION_CONSTANTS = {
+    'sg_terms_aggred': True,
+    'sg_time_to_screen_submissions': 600000,
+    'sg_time_to_vote': 300000,
+    'sg_time_to_read_suppliments': 90000,
+}
+
+
+class SyncPlan(object):
+    """
+    Every change a sync would make, as worked out by ShotgunVES.plan_sync.
+    Each action is a plain dict so the plan can be saved with to_json and
+    run later by ShotgunVES.execute_plan.
+    """
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    RETIRE = 'retire'
+    UPLOAD = 'upload'
+
+    def __init__(self, actions=None):
+        self.actions = actions or []
+
+    def add(self, action, entry, **kwargs):
+        planned = {
+            'action': action,
+            'entry_id': entry.id,
+            'code': str(entry.entryNum),
+        }
+        planned.update(kwargs)
+        self.actions.append(planned)
+
+    def of_type(self, action):
+        return [
+            planned for planned in self.actions
+            if planned['action'] == action
+        ]
+
+    @property
+    def bytes_to_transfer(self):
+        return sum(planned.get('bytes') or 0 for planned in self.actions)
+
+    def summary(self):
+        summary = dict(
+            (action, len(self.of_type(action)))
+            for action in (self.CREATE, self.UPDATE, self.RETIRE, self.UPLOAD)
+        )
+        summary['bytes'] = self.bytes_to_transfer
+        return summary
+
+    def to_json(self):
+        return json.dumps({'actions': self.actions})
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(json.loads(data)['actions'])
+
 
 class ShotgunVES(Shotgun):
 
     shotgun_submission_entity = 'CustomEntity04'
     shotgun_version_entity = 'Version'
+    shotgun_company_entity = 'CustomNonProjectEntity01'
 
     def __init__(self, **kwargs):
 
@@ -43,6 +191,41 @@ class ShotgunVES(Shotgun):
             'project', 'is', self.project_info
         ]
 
+        # Run scoped cache of normalized company name to company entity
+        self._companies = None
+        self._company_lock = threading.Lock()
+
+        # Run scoped caches of categories by number, the vetting list and
+        # the script's own ApiUser
+        self._categories = {}
+        self._vetting_list = None
+        self._api_user = None
+        self._submission_base = None
+        # Whether the Shot schema has CATEGORY_AGGREGATE_FIELDS
+        self._has_category_aggregates = None
+
+        # Run scoped registry of source md5 to the version holding its
+        # proxy, and the bytes not transferred thanks to it
+        self._media = None
+        self._media_lock = threading.Lock()
+        self.bytes_saved = 0
+
+        # Optional SyncStateStore to skip finished work, and the name the
+        # current run records its position under
+        self.state = kwargs.get('state')
+        self.run_name = kwargs.get('run_name')
+        self.run_fingerprint = None
+
+        # Shared by default so every client in the process adapts together
+        self.rate_limiter = kwargs.get(
+            'rate_limiter', rate_limit.rate_limiter
+        )
+
+        # Local copies of swift objects, kept for retries and later runs
+        self.swift_cache = kwargs.get(
+            'swift_cache', swift_transfer.swift_cache
+        )
+
         super(ShotgunVES, self).__init__(
             SERVER_PATH, settings.SHOTGUN_USER, settings.SHOTGUN_KEY
         )
@@ -59,13 +242,114 @@ class ShotgunVES(Shotgun):
     def log(self, msg):
         self.logger.log(self.level, msg)
 
+    def log_data(self, title, data, level=logging.DEBUG):
+        """
+        Log a title and pretty printed data, only formatting the data when
+        the level is enabled
+        """
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, title)
+            self.logger.log(level, pformat(data))
+
+    def _with_retries(self, idempotent, limit, func, *args, **kwargs):
+        """
+        Call func under the rate limiter, retrying with jittered backoff.
+        Throttled requests were not processed so are always retried, other
+        transient failures are only retried for idempotent requests.
+        """
+        attempt = 0
+        while True:
+            if limit:
+                self.rate_limiter.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                throttled = rate_limit.is_throttle(e)
+                if throttled:
+                    self.rate_limiter.throttled()
+
+                attempt += 1
+                if attempt >= rate_limit.RETRY_ATTEMPTS or not (
+                    throttled or (idempotent and rate_limit.is_transient(e))
+                ):
+                    raise
+
+                delay = max(
+                    rate_limit.backoff(attempt), rate_limit.retry_after(e)
+                )
+                self.debug(
+                    'Shotgun request failed (%s), retry %s in %.1fs'
+                    % (e, attempt, delay)
+                )
+                time.sleep(delay)
+            else:
+                if limit:
+                    self.rate_limiter.succeeded()
+                return result
+
+    @staticmethod
+    def _is_idempotent(method, params):
+        if method == 'batch':
+            return all(
+                request.get('request_type') == 'update' for request in params
+            )
+        return method not in ('create', 'delete', 'revive', 'finish_upload')
+
+    def _call_rpc(self, method, params, *args, **kwargs):
+        # Every API call goes through here
+        return self._with_retries(
+            self._is_idempotent(method, params), True,
+            super(ShotgunVES, self)._call_rpc, method, params, *args, **kwargs
+        )
+
+    def upload(self, *args, **kwargs):
+        # The rpc calls within are limited already, this retries a throttled
+        # transfer to storage. upload_thumbnail comes through here too.
+        return self._with_retries(
+            False, False, super(ShotgunVES, self).upload, *args, **kwargs
+        )
+
     def _find_in_project(self, entity_type, filters, *args, **kwargs):
         filters.append(self._project_filter)
         return self.find_one(
             entity_type, filters, *args, **kwargs
         )
 
+    def find_by_codes(self, entity_type, codes, fields):
+        """
+        Find every entity of the project with one of the codes, BATCH_SIZE
+        codes per query
+        :param entity_type:
+        :param codes:
+        :param fields:
+        :return: dict of code to entity
+        """
+        codes = list(codes)
+        found = {}
+        for start in range(0, len(codes), BATCH_SIZE):
+            entities = self.find(
+                entity_type,
+                [
+                    ['code', 'in', codes[start:start + BATCH_SIZE]],
+                    self._project_filter,
+                ],
+                ['code'] + list(fields)
+            )
+            for entity in entities:
+                found[entity['code']] = entity
+        return found
+
+    def _batch_in_chunks(self, requests):
+        results = []
+        for start in range(0, len(requests), BATCH_SIZE):
+            results.extend(self.batch(requests[start:start + BATCH_SIZE]))
+        return results
+
     def get_category(self, category_number):
+        category = self._categories.get(category_number)
+        if category is not None:
+            return category
+
         category_fields = ['code', 'sg_category_number']
         category = self._find_in_project(
             'Shot', [['sg_category_number', 'is', category_number]],
@@ -75,8 +359,23 @@ class ShotgunVES(Shotgun):
             raise Exception(
                 'Could not find shotgun category %s' % category_number
             )
+        self._categories[category_number] = category
         return category
 
+    def load_categories(self):
+        """
+        Read every category of the project in one go
+        :return: dict of category number to category
+        """
+        categories = self.find(
+            'Shot',
+            [['sg_category_number', 'is_not', None], self._project_filter],
+            ['code', 'sg_category_number']
+        )
+        for category in categories:
+            self._categories[category['sg_category_number']] = category
+        return self._categories
+
     def retire_entry(self, entry_num):
         """
         Retires an entry, can be reversed under most circumstances
@@ -96,23 +395,125 @@ class ShotgunVES(Shotgun):
             self.update(
                 self.shotgun_submission_entity,
                 entry['id'],
-                {'sg_status_list': 'wdraw'}
+                {'sg_status_list': WITHDRAWN_STATUS}
             )
             return entry['id']
 
+    def withdraw_submissions(self, submission_ids):
+        """
+        Set submissions as withdrawn with batched updates
+        :param submission_ids:
+        """
+        self._batch_in_chunks([
+            {
+                'request_type': 'update',
+                'entity_type': self.shotgun_submission_entity,
+                'entity_id': submission_id,
+                'data': {'sg_status_list': WITHDRAWN_STATUS},
+            }
+            for submission_id in submission_ids
+        ])
+
+    def retire_deleted_entries(self):
+        """
+        Retire the submission of every deleted entry in one pass, one query
+        for the entries, one find per BATCH_SIZE codes and batched updates.
+        :return: dict of retired, already withdrawn and missing entry codes
+        """
+        deleted = Entry.objects.filter(
+            hasBeenDeleted=True, shotgunSync=False
+        ).select_related('entryNum')
+        codes = [str(entry.entryNum) for entry in deleted]
+
+        submissions = self.find_by_codes(
+            self.shotgun_submission_entity, codes, ['sg_status_list']
+        )
+
+        result = {'retired': [], 'already_withdrawn': [], 'missing': []}
+        to_withdraw = []
+
+        for code in codes:
+            submission = submissions.get(code)
+            if submission is None:
+                result['missing'].append(code)
+            elif submission['sg_status_list'] == WITHDRAWN_STATUS:
+                result['already_withdrawn'].append(code)
+            else:
+                result['retired'].append(code)
+                to_withdraw.append(submission['id'])
+
+        self.withdraw_submissions(to_withdraw)
+
+        self.log(
+            'Retired %s entries, %s already withdrawn, %s not in shotgun' % (
+                len(result['retired']), len(result['already_withdrawn']),
+                len(result['missing'])
+            )
+        )
+        return result
+
     def get_vetting_check_list(self):
         """
         get some default vetting fields to attach for new entries.
         :return: vetting check list
         """
+        if self._vetting_list is not None:
+            return self._vetting_list
+
         vetting_list = self.find_one(
             "TaskTemplate",
             [['code', 'is', 'vettingCheckList']]
         )
         if not vetting_list:
             raise Exception('Could not find vetting list.')
+        self._vetting_list = vetting_list
         return vetting_list
 
+    def warm_read_caches(self):
+        """
+        Fill the read caches (companies, categories and vetting list) with
+        one bulk read each.
+        """
+        self.load_companies()
+        self.load_categories()
+        self.get_vetting_check_list()
+
+    def export_read_caches(self):
+        """
+        :return: the read caches as a json serializable dict
+        """
+        return {
+            'companies': self._companies,
+            'categories': [
+                category for category in self._categories.values()
+            ],
+            'vetting_list': self._vetting_list,
+        }
+
+    def load_read_caches(self, caches):
+        """
+        Seed the read caches from export_read_caches output, typically
+        written by a parent process so workers skip the warm up reads.
+        :param caches:
+        """
+        if caches.get('companies') is not None:
+            self._companies = dict(caches['companies'])
+        for category in caches.get('categories', []):
+            self._categories[category['sg_category_number']] = category
+        if caches.get('vetting_list') is not None:
+            self._vetting_list = caches['vetting_list']
+
+    def clear_read_caches(self):
+        """
+        Drop the run scoped caches of a client kept between runs, so
+        companies, categories and media added since are read again.
+        """
+        self._companies = None
+        self._categories = {}
+        self._vetting_list = None
+        self._submission_base = None
+        self._media = None
+
     def update_entry_status(self, entry):
 
         if entry.shotgunSync:
@@ -125,7 +526,7 @@ class ShotgunVES(Shotgun):
                 'Entry %s has been deleted, retiring from shotgun '
                 % str(entry.entryNum)
             )
-            retire_result = self.retire_entry(entry.entry_num)
+            retire_result = self.retire_entry(str(entry.entryNum))
             if retire_result:
                 self.log('Retired %s from shotgun ' % entry.entryNum)
             else:
@@ -136,14 +537,13 @@ class ShotgunVES(Shotgun):
 
         self.log('Entry %s status is up to date.' % entry.entryNum)
 
-    def get_user(self, user_data):
+    @staticmethod
+    def get_user_login(user_data):
         """
-        Returns a user from the data, either an existing one or one that it
-        creates in this method
+        Build the shotgun login for a person from their first and last name
         :param user_data:
-        :return:
+        :return: login, or None if the person has no name
         """
-
         if not user_data['firstname'] and not user_data['lastname']:
             return None
 
@@ -156,7 +556,19 @@ class ShotgunVES(Shotgun):
 
         # Shotgun needs to have non unicode characters or else is replaces
         # then with a space
-        user_login = user_login.encode('ascii', errors='ignore')
+        return user_login.encode('ascii', errors='ignore')
+
+    def get_user(self, user_data):
+        """
+        Returns a user from the data, either an existing one or one that it
+        creates in this method
+        :param user_data:
+        :return:
+        """
+
+        user_login = self.get_user_login(user_data)
+        if user_login is None:
+            return None
 
         user_data['login'] = user_login
         user_info = self.find_one(
@@ -184,51 +596,74 @@ class ShotgunVES(Shotgun):
             user_data = self.update('HumanUser', user_info['id'], user_data)
             return user_data
 
-    # Generate a VES shotgun specific list of entrant dictionaries from a
-    # entry object
-    def generate_entrant_data(self, entry):
+    @classmethod
+    def merge_user_data(cls, user_data_list):
+        """
+        Merge the field dicts of everybody sharing a login. The first non
+        empty value for a field wins, so an entrant's job title is not
+        blanked by the same person appearing as the submission contact.
+        :param user_data_list:
+        :return: dict of login to merged user data
+        """
+        merged = {}
+        for user_data in user_data_list:
+            user_login = cls.get_user_login(user_data)
+            if user_login is None:
+                continue
+            person = merged.setdefault(user_login, {})
+            for field, value in user_data.items():
+                if person.get(field) in (None, ''):
+                    person[field] = value
+        return merged
+
+    def resolve_people(self, user_data_list):
+        """
+        Resolve a list of people against shotgun with one lookup and one
+        create/update per distinct login
+        :param user_data_list:
+        :return: dict of login to shotgun user
+        """
+        people = {}
+        merged = self.merge_user_data(user_data_list)
+        for user_login, user_data in merged.items():
+            people[user_login] = self.get_user(user_data)
+        return people
 
-        # a list of dictionary's, containing entrant information
-        entrant_list = []
-        entrants = []
-        entrant_dict = {
-            'entrant_1': None,
-            'entrant_1_job_title': None,
-            'entrant_1_url': None,
-            'entrant_2': None,
-            'entrant_2_job_title': None,
-            'entrant_2_url': None,
-            'entrant_3': None,
-            'entrant_3_job_title': None,
-            'entrant_3_url': None,
-            'entrant_4': None,
-            'entrant_4_job_title': None,
-            'entrant_4_url': None,
-            'entrant_5': None,
-            'entrant_5_job_title': None,
-            'entrant_5_url': None,
-        }
-        model_identifier = 1
-        if entry.entrant1:
-            entrants.append((entry.entrant1, model_identifier))
-        model_identifier += 1
-        if entry.entrant2:
-            entrants.append((entry.entrant2, model_identifier))
-        model_identifier += 1
-        if entry.entrant3:
-            entrants.append((entry.entrant3, model_identifier))
-        model_identifier += 1
-        if entry.entrant4:
-            entrants.append((entry.entrant4, model_identifier))
-        model_identifier += 1
-        if entry.entrant5:
-            entrants.append((entry.entrant5, model_identifier))
-
-        for entrant, model_identifier in entrants:
-            job_title_or_credit = getattr(
-                entry, 'e%sjobTitleOrCredit' % model_identifier, '')
-            url = getattr(
-                entry, 'e%sURL' % model_identifier, 'http://tempuri.com')
+    def get_entry_people(self, entry):
+        """
+        Resolve every entrant, signature and the contact of an entry at once,
+        the same person is often all three.
+        :param entry:
+        :return: dict of login to shotgun user
+        """
+        user_data_list = [
+            entrant_data
+            for _, _, _, entrant_data in self._entrant_user_data(entry)
+        ]
+        user_data_list.extend(self._signature_user_data(entry))
+        user_data_list.append(self._contact_user_data(entry))
+        return self.resolve_people(user_data_list)
+
+    def _get_person(self, people, user_data):
+        if people is None:
+            return self.get_user(user_data)
+        return people.get(self.get_user_login(user_data))
+
+    def _entrant_user_data(self, entry):
+        """
+        Build the shotgun user data for each entrant of an entry
+        :param entry:
+        :return: list of (model identifier, job title, url data, user data)
+        """
+        entrant_user_data = []
+        for model_identifier, entrant_field, job_title_field, url_field, \
+                _, _, _ in ENTRANT_SLOTS:
+            entrant = getattr(entry, entrant_field)
+            if not entrant:
+                continue
+
+            job_title_or_credit = getattr(entry, job_title_field, '')
+            url = getattr(entry, url_field, 'http://tempuri.com')
 
             if url:
                 url_data = {
@@ -257,32 +692,45 @@ class ShotgunVES(Shotgun):
                 'sg_entrant_number': model_identifier,
                 'sg_credit_url': url_data,
             }
-            entrant_info = self.get_user(entrant_data)
+            entrant_user_data.append(
+                (model_identifier, job_title_or_credit, url_data, entrant_data)
+            )
 
-            if entrant_info is not None:
-                entrant_list.extend(
-                    [{'type': 'HumanUser', 'id': entrant_info['id']}])
+        return entrant_user_data
 
-            entrant_dict['entrant_%s' % model_identifier] = {
-                'type': 'HumanUser', 'id': entrant_info['id']
-            }
-            _jt_index = 'entrant_%s_job_title' % model_identifier
-            _url_index = 'entrant_%s_url' % model_identifier
+    # Generate a VES shotgun specific list of entrant dictionaries from a
+    # entry object
+    def generate_entrant_data(self, entry, people=None):
+
+        # a list of dictionary's, containing entrant information
+        entrant_list = []
+        entrant_dict = dict.fromkeys(key for key, _ in SUBMITTER_FIELDS)
+
+        for model_identifier, job_title_or_credit, url_data, entrant_data \
+                in self._entrant_user_data(entry):
+            entrant_info = self._get_person(people, entrant_data)
+
+            if entrant_info is None:
+                continue
 
-            entrant_dict[_jt_index] = job_title_or_credit
-            entrant_dict[_url_index] = url_data
+            user = {'type': 'HumanUser', 'id': entrant_info['id']}
+            entrant_list.append(user)
+
+            _, _, _, _, user_index, jt_index, url_index = \
+                ENTRANT_SLOTS[model_identifier - 1]
+            entrant_dict[user_index] = user
+            entrant_dict[jt_index] = job_title_or_credit
+            entrant_dict[url_index] = url_data
 
         return entrant_list, entrant_dict
 
-    def generate_signature_data(self, entry):
+    def _signature_user_data(self, entry):
         """
-        Generate a VES shotgun specific list of signature dictionaries from a
-        sohonet entry object
+        Build the shotgun user data for each signature of an entry
         :param entry:
-        :return:
+        :return: list of user data
         """
 
-        signature_details_list = []
         signatures = []
 
         if entry.submittingEntrant:
@@ -294,6 +742,7 @@ class ShotgunVES(Shotgun):
         if entry.entrantFacilityMgr:
             signatures.append(entry.entrantFacilityMgr)
 
+        signature_user_data = []
         sg_sig_number = 0
 
         for entrant in signatures:
@@ -303,7 +752,7 @@ class ShotgunVES(Shotgun):
                 entry, 'e%sjobTitleOrCredit' % e_id, ''
             )
             sg_country = str(entrant.country).encode("ISO-8859-1", 'ignore')
-            signature_data = {
+            signature_user_data.append({
                 'sg_country': sg_country,
                 'email': entrant.emailAddr,
                 'firstname': entrant.firstName,
@@ -312,8 +761,23 @@ class ShotgunVES(Shotgun):
                 'sg_phone': entrant.primaryPhone,
                 'sg_job_title': job_title_or_credit,
                 'sg_signature_number': sg_sig_number,
-            }
-            signature_info = self.get_user(signature_data)
+            })
+
+        return signature_user_data
+
+    def generate_signature_data(self, entry, people=None):
+        """
+        Generate a VES shotgun specific list of signature dictionaries from a
+        sohonet entry object
+        :param entry:
+        :param people: logins already resolved by get_entry_people
+        :return:
+        """
+
+        signature_details_list = []
+
+        for signature_data in self._signature_user_data(entry):
+            signature_info = self._get_person(people, signature_data)
             if signature_info is not None:
                 signature_details_list.extend(
                     [{'type': 'HumanUser', 'id': signature_info['id']}]
@@ -321,12 +785,11 @@ class ShotgunVES(Shotgun):
 
         return signature_details_list
 
-    def generate_contact_data(self, entry):
+    def _contact_user_data(self, entry):
         """
-        Generate a VES shotgun specific 'contact' dictionary from a
-        sohonet entry object
+        Build the shotgun user data for the submission contact of an entry
         :param entry:
-        :return:
+        :return: user data
         """
 
         country = str(
@@ -335,7 +798,7 @@ class ShotgunVES(Shotgun):
 
         state = utils.get_clean_state(entry.submissionContact.stateProvince)
 
-        contact_data = {
+        return {
             'sg_address': entry.submissionContact.streetAddress,
             'sg_apt': entry.submissionContact.suite,
             'sg_city': entry.submissionContact.city,
@@ -350,7 +813,19 @@ class ShotgunVES(Shotgun):
             'sg_state': state,
             'sg_phone': entry.submissionContact.primaryPhone,
         }
-        contact_info = self.get_user(contact_data)
+
+    def generate_contact_data(self, entry, people=None):
+        """
+        Generate a VES shotgun specific 'contact' dictionary from a
+        sohonet entry object
+        :param entry:
+        :param people: logins already resolved by get_entry_people
+        :return:
+        """
+
+        contact_info = self._get_person(
+            people, self._contact_user_data(entry)
+        )
         contact_data = {'type': 'HumanUser', 'id': contact_info['id']}
 
         return contact_data
@@ -375,25 +850,99 @@ class ShotgunVES(Shotgun):
             ]
         )
 
+    @staticmethod
+    def normalize_company_name(company):
+        return ' '.join(company.split()).lower()
+
+    def load_companies(self):
+        """
+        Read every company in shotgun in one go, keyed by normalized name,
+        so get_company does not need a round trip per entry.
+        :return: dict of normalized name to company entity
+        """
+        companies = {}
+        for company in self.find(
+            self.shotgun_company_entity, [], ['id', 'code']
+        ):
+            if not company['code']:
+                continue
+            companies.setdefault(
+                self.normalize_company_name(company['code']),
+                {'type': self.shotgun_company_entity, 'id': company['id']}
+            )
+        self._companies = companies
+        return companies
+
     def get_company(self, company):
         """
-        See if a company is already in the database,
-        if so returns the identifiers
+        See if a company is already in the database, creating it once per
+        run if not, and returns the identifiers
         :param company:
         :return:
         """
-        data = self.find_one(
-            'CustomNonProjectEntity01', [['code', 'is', company]], ['id']
-        )
-        if data and company != '':
-            data = self.create(
-                'CustomNonProjectEntity01', {'code': company}
-            )
-        if data:
-            return {'type': 'CustomNonProjectEntity01', 'id': data['id']}
-        else:
+        if not company or not company.strip():
             return None
 
+        company_key = self.normalize_company_name(company)
+
+        # Held across the create so two threads asking for the same new
+        # company only create it once
+        with self._company_lock:
+            if self._companies is None:
+                self.load_companies()
+
+            data = self._companies.get(company_key)
+            if data is None:
+                self.log('Creating company %s' % company)
+                created = self.create(
+                    self.shotgun_company_entity,
+                    {'code': ' '.join(company.split())}
+                )
+                data = {
+                    'type': self.shotgun_company_entity, 'id': created['id']
+                }
+                self._companies[company_key] = data
+
+        return data
+
+    def create_missing_companies(self, companies):
+        """
+        Create every company not in shotgun yet with batched creates, so
+        processes seeded with the read caches afterwards find them all and
+        none of them create a company of their own
+        :param companies: company names as entered
+        :return: number of companies created
+        """
+        with self._company_lock:
+            if self._companies is None:
+                self.load_companies()
+
+            missing = {}
+            for company in companies:
+                if not company or not company.strip():
+                    continue
+                company_key = self.normalize_company_name(company)
+                if company_key not in self._companies:
+                    missing.setdefault(company_key, ' '.join(company.split()))
+            missing = sorted(missing.items())
+
+            created = self._batch_in_chunks([
+                {
+                    'request_type': 'create',
+                    'entity_type': self.shotgun_company_entity,
+                    'data': {'code': code},
+                }
+                for _, code in missing
+            ])
+            for (company_key, _), company in zip(missing, created):
+                self._companies[company_key] = {
+                    'type': self.shotgun_company_entity, 'id': company['id']
+                }
+
+        if missing:
+            self.log('Created %s companies' % len(missing))
+        return len(missing)
+
     def generate_submission_data(self, entry, vetting_list,
                                  entrant_details_list,
                                  entrant_dict, signature_details_list,
@@ -414,48 +963,41 @@ class ShotgunVES(Shotgun):
         distribution_company = self.get_company(entry.distributionCompany)
         production_company = self.get_company(entry.productionCompany)
 
-        submit_data = {
+        # Shared by every submission of the run, only the per entry fields
+        # are added to the copy
+        base = self._submission_base
+        if base is None or base['task_template'] is not vetting_list:
+            base = dict(
+                SUBMISSION_CONSTANTS,
+                project=self.project_info,
+                task_template=vetting_list
+            )
+            self._submission_base = base
+
+        submit_data = dict(base)
+        submit_data.update({
             'code': str(entry.entryNum),
             'sg_entry_title': entry.sequenceOrShotname,
             'sg_project_title': entry.projectName,
             'sg_premiere_date': entry.dateOfPremiere.strftime('%Y-%m-%d'),
-            'project': self.project_info,
             'sg_category': category,
             'sg_production_company': production_company,
-            'sg_terms_aggred': True,
             'sg_facility_employed': entry.entryAtFacility,
             'sg_submitter_list': entrant_details_list,
             'sg_signature_list': signature_details_list,
             'sg_contact': contact_data,
-            'sg_time_to_screen_submissions': 600000,
-            'sg_time_to_vote': 300000,
-            'sg_time_to_read_suppliments': 90000,
-            'task_template': vetting_list,
             'sg_soho_updated': entry.lastEdit,
             'sg_payment': entry.hasPaid,
             'sg_payment_amount': float(entry.getPrice()),
-            'sg_submitter_1': entrant_dict['entrant_1'],
-            'sg_submitter_1_url': entrant_dict['entrant_1_url'],
-            'sg_submitter_1_job_title': entrant_dict['entrant_1_job_title'],
-            'sg_submitter_2': entrant_dict['entrant_2'],
-            'sg_submitter_2_url': entrant_dict['entrant_2_url'],
-            'sg_submitter_2_job_title': entrant_dict['entrant_2_job_title'],
-            'sg_submitter_3': entrant_dict['entrant_3'],
-            'sg_submitter_3_url': entrant_dict['entrant_3_url'],
-            'sg_submitter_3_job_title': entrant_dict['entrant_3_job_title'],
-            'sg_submitter_4': entrant_dict['entrant_4'],
-            'sg_submitter_4_url': entrant_dict['entrant_4_url'],
-            'sg_submitter_4_job_title': entrant_dict['entrant_4_job_title'],
-            'sg_submitter_5': entrant_dict['entrant_5'],
-            'sg_submitter_5_url': entrant_dict['entrant_5_url'],
-            'sg_submitter_5_job_title': entrant_dict['entrant_5_job_title']
 
             # TODO - No longer exists in shotgun
             # 'sg_distribution_company': distribution_company,
             # 'sg_entry_mos': entry.no_audio,
             # 'sg_bna_mos': entry.no_audio_ba,
             # 'sg_petition': False,
-        }
+        })
+        for key, field in SUBMITTER_FIELDS:
+            submit_data[field] = entrant_dict[key]
 
         return submit_data
 
@@ -467,41 +1009,67 @@ class ShotgunVES(Shotgun):
         storage.ensure_container(settings.VES_PDF_CONTAINER)
         return storage.get_connection()
 
-    def update_entry_details(self, entry):
-        self.log('Updating entry %s details' % entry)
-
-        if self.update_entry_status(entry):
-            # Entry has been deleted or marked as do not continue
-            return
-
+    def build_submission_data(self, entry):
+        """
+        Resolve the people, category and companies of an entry and build
+        the submission payload, without writing the submission itself.
+        :param entry:
+        :return: submission data
+        """
         category = self.get_category(entry.entryNum.category.catNum)
         vetting_list = self.get_vetting_check_list()
 
-        entrant_details, entrant_list = self.generate_entrant_data(entry)
-
-        self.debug("Entrant Details:")
-        self.debug(pformat(entrant_details))
-
-        self.debug("Entrants List:")
-        self.debug(pformat(entrant_list))
+        people = self.get_entry_people(entry)
 
-        signature_details_list = self.generate_signature_data(entry)
+        entrant_details, entrant_list = self.generate_entrant_data(
+            entry, people
+        )
 
-        contact_data = self.generate_contact_data(entry)
+        self.log_data("Entrant Details:", entrant_details)
+        self.log_data("Entrants List:", entrant_list)
 
-        self.debug("Contact Data:")
-        self.debug(pformat(contact_data))
+        signature_details_list = self.generate_signature_data(entry, people)
 
-        submit_info = self.get_submit_info(entry)
+        contact_data = self.generate_contact_data(entry, people)
 
-        self.debug("Submit Info:")
-        self.debug(pformat(submit_info))
+        self.log_data("Contact Data:", contact_data)
 
-        submit_data = self.generate_submission_data(
+        return self.generate_submission_data(
             entry, vetting_list, entrant_details, entrant_list,
             signature_details_list, contact_data, category
         )
 
+    @staticmethod
+    def get_submission_user_ids(submit_data):
+        users = list(submit_data['sg_submitter_list'])
+        users.extend(submit_data['sg_signature_list'])
+        if submit_data['sg_contact']:
+            users.append(submit_data['sg_contact'])
+        return set(user['id'] for user in users)
+
+    def update_entry_details(self, entry, context=None, slates=True):
+        """
+        Create or update the submission of an entry
+        :param entry:
+        :param context: from get_sync_context
+        :param slates: upload the slates too, if False the caller must call
+            update_entry_slates for the details to be recorded as synced
+        """
+        self.log('Updating entry %s details' % entry)
+
+        if self.update_entry_status(entry):
+            # Entry has been deleted or marked as do not continue
+            return
+
+        submit_data = self.build_submission_data(entry)
+
+        if context is None:
+            submit_info = self.get_submit_info(entry)
+        else:
+            submit_info = context['submit_info']
+
+        self.log_data("Submit Info:", submit_info)
+
         if submit_info is None:  # entry is not in shotgun yet
             # need to create new
             self.log('Creating new submission %s' % entry.entryNum)
@@ -514,10 +1082,51 @@ class ShotgunVES(Shotgun):
                 self.shotgun_submission_entity, submit_info['id'], submit_data
             )
 
-        self.log("Uploading entry Slate")
+        if context is not None:
+            context['submit_info'] = submit_data
+
+        if slates:
+            self.update_entry_slates(entry, submit_data)
+
+    def update_entry_slates(self, entry, submit_data):
+        """
+        Upload the slates of a submission, recording the entry's details as
+        synced once they are in
+        :param entry:
+        :param submit_data: the submission update_entry_details wrote
+        """
+        slates_uploaded = self.upload_slates(entry, submit_data['id'])
+
+        if slates_uploaded and self.state is not None:
+            self.state.record_details(
+                entry.id, entry.lastEdit, submit_data['id'],
+                self.get_submission_user_ids(submit_data)
+            )
+
+    def upload_slates(self, entry, submission_id):
+        """
+        Upload the entry and B&A slates of a submission, unless the sync
+        state shows these exact slates were uploaded already
+        :param entry:
+        :param submission_id:
+        :return: True if the slates are in shotgun
+        """
         # text on the slates may have changed so update these
-        temp_dir = tempfile.mkdtemp()
         aa_slate_contents = genSlate(entry.id, True)
+        ba_slate_contents = genSlate(entry.id, False)
+
+        slate_hash = hashlib.sha1(
+            aa_slate_contents + ba_slate_contents
+        ).hexdigest()
+        if self.state is not None and \
+                self.state.slate_hash(entry.id) == slate_hash:
+            self.log('Slates for %s are up to date' % entry.entryNum)
+            return True
+
+        uploaded = True
+
+        self.log("Uploading entry Slate")
+        temp_dir = tempfile.mkdtemp()
         aa_shotgun_name = str(entry.entryNum) + '.slateEntry.png'
         aa_temp_file = os.path.join(temp_dir, aa_shotgun_name)
         aa_temp_file_h = open(aa_temp_file, 'wb')
@@ -527,7 +1136,7 @@ class ShotgunVES(Shotgun):
         try:
             self.upload(
                 self.shotgun_submission_entity,
-                submit_data['id'],
+                submission_id,
                 aa_temp_file,
                 "sg_entry_slate",
                 aa_shotgun_name
@@ -536,7 +1145,7 @@ class ShotgunVES(Shotgun):
             os.rmdir(temp_dir)
 
         except ShotgunError:
-
+            uploaded = False
             self.exception(
                 "Shotgun Upload Error on entry slate for %s " % entry.entryNum
             )
@@ -544,7 +1153,6 @@ class ShotgunVES(Shotgun):
         self.log("Uploading banda Slate")
 
         temp_dir = tempfile.mkdtemp()
-        ba_slate_contents = genSlate(entry.id, False)
         ba_shotgun_name = str(entry.entryNum) + '.slateBNA.png'
         ba_temp_file = os.path.join(temp_dir, ba_shotgun_name)
         ba_temp_file_h = open(ba_temp_file, 'wb')
@@ -554,7 +1162,7 @@ class ShotgunVES(Shotgun):
         try:
             self.upload(
                 self.shotgun_submission_entity,
-                submit_data['id'],
+                submission_id,
                 ba_temp_file_h.name,
                 "sg_bna_slate",
                 ba_shotgun_name
@@ -562,10 +1170,16 @@ class ShotgunVES(Shotgun):
             os.unlink(ba_temp_file)
             os.rmdir(temp_dir)
         except ShotgunError:
+            uploaded = False
             self.exception(
                 "Shotgun Upload Error on banda slate for %s" % entry.entryNum
             )
 
+        if uploaded and self.state is not None:
+            self.state.record_slate_hash(entry.id, slate_hash)
+
+        return uploaded
+
     def get_version_info(self, code):
         """
         return a current submission if it exists, otherwise return None
@@ -580,201 +1194,932 @@ class ShotgunVES(Shotgun):
             self.get_version_fields()
         )
 
-    def update_ba_media(self, entry):
-        self._update_media(entry, False)
-
-    def update_entry_media(self, entry):
-        self._update_media(entry, True)
+    @staticmethod
+    def get_media_names(entry, entry_files, aa):
+        """
+        Work out the names of an entry's AA or B&A proxy
+        :param entry:
+        :param entry_files: EntryFiles with findFiles already run
+        :param aa: AA media if True, B&A media otherwise
+        :return: (md5, source filename, version code, swift object name),
+            the version code and swift name are None without an md5
+        """
+        if aa:
+            entry_md5 = entry_files.getUserEntryMD5()
+        else:
+            entry_md5 = entry_files.getUserBaMD5()
 
-    def _update_media(self, entry, aa):
-        self.log('Updating %s media ' % entry.entryNum)
+        if entry_files.entry_name:
+            entry_filename = os.path.basename(entry_files.entry_name)
+        else:
+            entry_filename = None
 
-        submit_info = self.get_submit_info(entry)
+        if entry_md5 is None:
+            return entry_md5, entry_filename, None, None
 
-        if submit_info is None:  # no entry exists, fail
-            self.log(
-                'Failed to find entry %s details in shotgun, '
-                'not uploading entry media.' % str(entry.entryNum)
+        if aa:
+            code = entry.aa_code(entry_md5)
+            swift_mp4_name = '%s.aa.%s.mov.%s.mp4' % (
+                entry.entryNum,
+                entry_md5,
+                MAIN_PROXY_NAME
             )
-            return 1
-
-        entry_files = EntryFiles(entry)
-        entry_files.findFiles()
-
-        if aa and not entry_files.entry_found:
-            self.log(
-                "AA Not Found in swift %s - %s"
-                % (entry.entryNum, entry)
+        else:
+            code = entry.ba_code(entry_md5)
+            swift_mp4_name = '%s.ba.%s.mov.%s.mp4' % (
+                entry.entryNum,
+                entry_md5,
+                MAIN_PROXY_NAME
             )
-            return
 
-        if not aa and not entry_files.ba_found:
-            self.log(
-                "BA Not Found in swift %s - %s"
+        return entry_md5, entry_filename, code, swift_mp4_name
+
+    def get_sync_context(self, entry, phases=ALL_PHASES, skip_synced=True):
+        """
+        Read what the phases of an entry share once: the submission, the
+        entry's files and the versions the phases will look for. Phases the
+        sync state shows as done are dropped unless skip_synced is False.
+        :param entry:
+        :param phases:
+        :param skip_synced:
+        :return: context dict passed to the phase methods, its phases are
+            the ones still to run
+        """
+        context = {
+            'submit_info': None,
+            'entry_files': None,
+            'versions': {},
+            'run_times_changed': False,
+            'phases': [],
+        }
+
+        state = self.state if skip_synced else None
+        codes = []
+
+        if PHASE_DETAILS in phases:
+            if state is not None and \
+                    state.details_synced(entry.id, entry.lastEdit):
+                self.log('Entry %s details already synced' % entry.entryNum)
+            else:
+                context['phases'].append(PHASE_DETAILS)
+
+        if PHASE_AA_MEDIA in phases or PHASE_BA_MEDIA in phases:
+            entry_files = EntryFiles(entry)
+            entry_files.findFiles()
+            context['entry_files'] = entry_files
+
+            for phase, aa, found in (
+                (PHASE_AA_MEDIA, True, entry_files.entry_found),
+                (PHASE_BA_MEDIA, False, entry_files.ba_found),
+            ):
+                if phase not in phases:
+                    continue
+                if found:
+                    entry_md5, _, code, _ = self.get_media_names(
+                        entry, entry_files, aa
+                    )
+                    if state is not None and entry_md5 is not None and \
+                            state.version_id(entry.id, phase, entry_md5):
+                        self.log(
+                            'Entry %s %s already synced'
+                            % (entry.entryNum, phase)
+                        )
+                        continue
+                    if code is not None:
+                        codes.append(code)
+                context['phases'].append(phase)
+
+        if PHASE_SUPPLEMENTAL in phases:
+            code = entry.supplemental_code()
+            if state is not None and \
+                    state.version_id(entry.id, PHASE_SUPPLEMENTAL, code):
+                self.log('Entry %s supplemental already synced'
+                         % entry.entryNum)
+            else:
+                context['phases'].append(PHASE_SUPPLEMENTAL)
+                codes.append(code)
+
+        if not context['phases']:
+            return context
+
+        context['submit_info'] = self.get_submit_info(entry)
+
+        if codes and context['submit_info'] is not None:
+            context['versions'] = self.find_by_codes(
+                self.shotgun_version_entity, codes, self.get_version_fields()
+            )
+
+        return context
+
+    def _record_run_position(self, entry, phase):
+        if self.state is not None and self.run_name:
+            self.state.set_run_position(
+                self.run_name, entry.id, phase, self.run_fingerprint
+            )
+
+    def sync_entry(self, entry, phases=ALL_PHASES, skip_synced=True):
+        """
+        Sync the given phases of an entry. The submission and versions are
+        read once for all of the phases and run times are recomputed at
+        most once, when a phase changed them.
+        :param entry:
+        :param phases: any of ALL_PHASES
+        :param skip_synced: skip phases the sync state shows as done. Only
+            for sweeps, edits to people and in shotgun do not change the
+            entry's lastEdit so their syncs must pass False.
+        :return: 1 if a phase failed
+        """
+        if self.update_entry_status(entry):
+            # Entry has been deleted or marked as do not continue
+            return
+
+        context = self.get_sync_context(entry, phases, skip_synced)
+        phases = context['phases']
+        failed = False
+
+        if PHASE_DETAILS in phases:
+            self._record_run_position(entry, PHASE_DETAILS)
+            self.update_entry_details(entry, context)
+
+        if PHASE_AA_MEDIA in phases:
+            self._record_run_position(entry, PHASE_AA_MEDIA)
+            failed |= self.update_entry_media(entry, context) == 1
+
+        if PHASE_BA_MEDIA in phases:
+            self._record_run_position(entry, PHASE_BA_MEDIA)
+            failed |= self.update_ba_media(entry, context) == 1
+
+        if PHASE_SUPPLEMENTAL in phases:
+            self._record_run_position(entry, PHASE_SUPPLEMENTAL)
+            failed |= self.update_supplemental(entry, context) == 1
+
+        if context['run_times_changed']:
+            self.update_run_times(entry)
+
+        if failed:
+            return 1
+
+    def update_ba_media(self, entry, context=None):
+        return self._update_media(entry, False, context)
+
+    def update_entry_media(self, entry, context=None):
+        return self._update_media(entry, True, context)
+
+    def _update_media(self, entry, aa, context=None):
+        """
+        Upload the AA or B&A proxy and thumbnail of an entry if the version
+        does not have it yet.
+        :param entry:
+        :param aa: AA media if True, B&A media otherwise
+        :param context: from get_sync_context, when given run times are
+            left to the caller
+        """
+        self.log('Updating %s media ' % entry.entryNum)
+
+        phase = PHASE_AA_MEDIA if aa else PHASE_BA_MEDIA
+
+        standalone = context is None
+        if standalone:
+            context = self.get_sync_context(entry, [phase], skip_synced=False)
+
+        submit_info = context['submit_info']
+
+        if submit_info is None:  # no entry exists, fail
+            self.log(
+                'Failed to find entry %s details in shotgun, '
+                'not uploading entry media.' % str(entry.entryNum)
+            )
+            return 1
+
+        entry_files = context['entry_files']
+
+        if aa and not entry_files.entry_found:
+            self.log(
+                "AA Not Found in swift %s - %s"
                 % (entry.entryNum, entry)
             )
             return
 
-        if aa:
-            entry_md5 = entry_files.getUserEntryMD5()
-        else:
-            entry_md5 = entry_files.getUserBaMD5()
+        if not aa and not entry_files.ba_found:
+            self.log(
+                "BA Not Found in swift %s - %s"
+                % (entry.entryNum, entry)
+            )
+            return
 
-        if entry_files.entry_name:
-            entry_filename = os.path.basename(entry_files.entry_name)
-        else:
-            entry_filename = None
+        entry_md5, entry_filename, entry_mp4_name, swift_mp4_name = \
+            self.get_media_names(entry, entry_files, aa)
 
         if entry_md5 is not None and entry_filename is not None:
-            if aa:
-                entry_mp4_name = entry.aa_code(entry_md5)
-                swift_mp4_name = '%s.aa.%s.mov.%s.mp4' % (
-                    entry.entryNum,
-                    entry_md5,
-                    MAIN_PROXY_NAME
-                )
-                code = entry.aa_code(entry_md5)
-            else:
-                entry_mp4_name = entry.ba_code(entry_md5)
-                swift_mp4_name = '%s.ba.%s.mov.%s.mp4' % (
-                    entry.entryNum,
-                    entry_md5,
-                    MAIN_PROXY_NAME
-                )
-                code = entry.ba_code(entry_md5)
-
-            version_info = self.get_version_info(entry_mp4_name)
+            version_info = context['versions'].get(entry_mp4_name)
             if version_info is None:  # no version exists, create
-                self.log(
-                    'Failed to find version %s in shotgun, '
-                    'creating new version.' % entry.entryNum
-                )
-                version_info = self.create(
-                    self.shotgun_version_entity,
-                    {
-                        'code': code,
-                        'entity': {
-                            'type': self.shotgun_submission_entity,
-                            'id': submit_info['id']
-                        },
-                        'project': self.project_info
-                    },
-                    self.get_version_fields()
+                version_info = self._create_media_version(
+                    entry, submit_info, entry_mp4_name
                 )
+                context['versions'][entry_mp4_name] = version_info
 
             sg_uploaded_movie = version_info['sg_uploaded_movie']
 
-            requires_upload = False
-            if not sg_uploaded_movie:
-                requires_upload = True
-            else:
-                if sg_uploaded_movie.get('name') != entry_mp4_name:
-                    requires_upload = True
-
-            if requires_upload:
+            if self._requires_upload(version_info, entry_mp4_name, entry_md5):
                 self.log(
                     "Shotgun field sg_uploaded_movie: %s" % sg_uploaded_movie
                 )
-                temp_dir = tempfile.mkdtemp()
-                entry_temp_file = os.path.join(temp_dir, entry_mp4_name)
-
-                f = open(entry_temp_file, 'wb')
-
                 connection = self.get_connection()
-                _, ob_contents = connection.get_object(
-                    settings.VES_PROXY_CONTAINER,
-                    swift_mp4_name,
-                    resp_chunk_size=(1024 * 1024 * 40)
-                )
+                source = self.find_uploaded_media(entry_md5)
+
+                if self._link_media(entry, version_info, phase, entry_md5,
+                                    source):
+                    self._count_saved(
+                        entry_mp4_name, self._swift_object_size(
+                            connection, settings.VES_PROXY_CONTAINER,
+                            swift_mp4_name
+                        )
+                    )
+                else:
+                    with self.swift_cache.pinned(
+                        connection,
+                        settings.VES_PROXY_CONTAINER,
+                        swift_mp4_name,
+                        filename=entry_mp4_name
+                    ) as entry_temp_file:
+                        uploaded = self._upload_proxy(
+                            entry, version_info, phase, entry_md5,
+                            entry_mp4_name, entry_temp_file
+                        )
+                    if not uploaded:
+                        return 1
+                context['run_times_changed'] = True
 
-                for chunk in ob_contents:
-                    f.write(chunk)
-                f.close()
+                # Thumbnail is generated from entry media so
+                # update this as well
+                if not self._share_media_thumbnail(version_info, source):
+                    _entryThumbFilename = self.get_thumbnail_name(
+                        entry_filename
+                    )
 
-                self.log("Uploading %s " % entry_mp4_name)
-                try:
-                    self.upload(
-                        self.shotgun_version_entity,
-                        version_info['id'],
-                        entry_temp_file,
-                        "sg_uploaded_movie",
-                        entry_mp4_name,
-                        entry_mp4_name
+                    thumb_data = swift_transfer.read_object(
+                        connection,
+                        settings.VES_THUMBS_CONTAINER,
+                        _entryThumbFilename
                     )
-                except ShotgunError:
-                    self.exception(
-                        "Shotgun Upload Error on "
-                        "entry media %s" + entry.entryNum
+
+                    self._upload_version_thumbnail(
+                        entry, version_info, thumb_data, _entryThumbFilename
                     )
-                    return 1
+            else:
+                self.log(
+                    "Version %s exists in shotgun, not uploading"
+                    % sg_uploaded_movie.get('name')
+                )
+                if self.state is not None:
+                    self.state.record_version(
+                        entry.id, phase, entry_md5, version_info['id']
+                    )
+        else:
+            self.log(
+                "Not Present entry MOV for %s - %s"
+                % (entry.entryNum, entry_filename)
+            )
+
+        if standalone:
+            self.update_run_times(entry)
+
+    def _create_media_version(self, entry, submit_info, code):
+        self.log(
+            'Failed to find version %s in shotgun, '
+            'creating new version.' % entry.entryNum
+        )
+        return self.create(
+            self.shotgun_version_entity,
+            {
+                'code': code,
+                'entity': {
+                    'type': self.shotgun_submission_entity,
+                    'id': submit_info['id']
+                },
+                'project': self.project_info
+            },
+            self.get_version_fields()
+        )
 
-                # Update the running time for this
-                m = MovFile(entry_temp_file)
-                runtime_seconds = int(m.getDuration())
+    def _requires_upload(self, version_info, name, md5):
+        sg_uploaded_movie = version_info['sg_uploaded_movie']
+        if not sg_uploaded_movie:
+            return True
+        if sg_uploaded_movie.get('name') == name:
+            return False
+        # Linked to the proxy another version uploaded for the same media
+        source = self.find_uploaded_media(md5)
+        if source is None:
+            return True
+        return source['sg_uploaded_movie'].get('id') != \
+            sg_uploaded_movie.get('id')
+
+    def load_media_registry(self):
+        """
+        Read every version of the project with an uploaded proxy in one go,
+        keyed by the md5 in its code, so media already in shotgun under
+        another entry or as the other of AA and B&A is linked rather than
+        transferred again.
+        :return: dict of md5 to version
+        """
+        media = {}
+        for version in self.find(
+            self.shotgun_version_entity,
+            [['sg_uploaded_movie', 'is_not', None], self._project_filter],
+            ['code', 'sg_uploaded_movie', 'sg_entry_run_time', 'image']
+        ):
+            match = MD5_PATTERN.search(version['code'] or '')
+            if match:
+                media.setdefault(match.group(0), version)
+        self._media = media
+        return media
+
+    def find_uploaded_media(self, md5):
+        """
+        :param md5: md5 of the source media
+        :return: version that already holds a proxy of it, or None
+        """
+        with self._media_lock:
+            if self._media is None:
+                self.load_media_registry()
+            return self._media.get(md5)
+
+    def _register_media(self, md5, version):
+        with self._media_lock:
+            if self._media is not None:
+                self._media.setdefault(md5, version)
+
+    def _count_saved(self, name, size):
+        with self._media_lock:
+            self.bytes_saved += size or 0
+        self.log('Linked %s to existing media, %s bytes not transferred'
+                 % (name, size or 'unknown'))
+
+    def _link_media(self, entry, version_info, phase, md5, source):
+        """
+        Point a version at the proxy another version already uploaded for
+        the same media, copying its run time.
+        :return: True if it was linked, False if it needs uploading
+        """
+        if source is None or source['id'] == version_info['id']:
+            return False
 
-                # 24 as 24 frames, the significance of
-                # 42 is unknown to me
-                entry_total = {
-                    'sg_entry_run_time': runtime_seconds * 24 * 42
+        try:
+            self.update(
+                self.shotgun_version_entity,
+                version_info['id'],
+                {
+                    'sg_uploaded_movie': {
+                        'type': 'Attachment',
+                        'id': source['sg_uploaded_movie']['id']
+                    },
+                    'sg_entry_run_time': source['sg_entry_run_time'],
                 }
-                self.update(
-                    self.shotgun_version_entity,
-                    version_info['id'],
-                    entry_total
-                )
+            )
+        except ShotgunError:
+            self.exception(
+                'Could not link %s to version %s, uploading instead'
+                % (entry.entryNum, source['id'])
+            )
+            return False
 
-                os.unlink(entry_temp_file)
-                os.rmdir(temp_dir)
+        if self.state is not None:
+            self.state.record_version(
+                entry.id, phase, md5, version_info['id']
+            )
+        return True
 
-                # Thumbnail is generated from entry media so
-                # update this as well
-                _entryThumbFilename = '%s.thumb.0720.0404.jpg' % (
-                    entry_filename,
-                )
+    def _share_media_thumbnail(self, version_info, source):
+        """
+        :return: True if the source version's thumbnail was shared
+        """
+        if source is None or source['id'] == version_info['id'] or \
+                not source.get('image'):
+            return False
+
+        try:
+            self.share_thumbnail(
+                [{'type': self.shotgun_version_entity,
+                  'id': version_info['id']}],
+                source_entity={
+                    'type': self.shotgun_version_entity, 'id': source['id']
+                }
+            )
+        except ShotgunError:
+            self.exception(
+                'Could not share thumbnail of version %s' % source['id']
+            )
+            return False
+        return True
+
+    def _upload_proxy(self, entry, version_info, phase, md5, name,
+                      proxy_path):
+        """
+        Upload a proxy to its version and set the version's run time
+        :return: True if it was uploaded
+        """
+        self.log("Uploading %s " % name)
+        try:
+            attachment_id = self.upload(
+                self.shotgun_version_entity,
+                version_info['id'],
+                proxy_path,
+                "sg_uploaded_movie",
+                name,
+                name
+            )
+        except ShotgunError:
+            self.exception(
+                "Shotgun Upload Error on entry media %s" % entry.entryNum
+            )
+            return False
+
+        # Update the running time for this
+        m = MovFile(proxy_path)
+        runtime_seconds = int(m.getDuration())
+
+        # 24 as 24 frames, the significance of
+        # 42 is unknown to me
+        entry_total = {
+            'sg_entry_run_time': runtime_seconds * 24 * 42
+        }
+        self.update(
+            self.shotgun_version_entity,
+            version_info['id'],
+            entry_total
+        )
 
-                thumb_temp_dir = tempfile.mkdtemp()
+        # Keep the local copy in step so later versions can link to it
+        version_info['sg_uploaded_movie'] = {
+            'type': 'Attachment', 'id': attachment_id, 'name': name
+        }
+        version_info.update(entry_total)
+        self._register_media(md5, version_info)
+
+        if self.state is not None:
+            self.state.record_version(
+                entry.id, phase, md5, version_info['id']
+            )
+        return True
+
+    @staticmethod
+    def get_thumbnail_name(entry_filename):
+        """
+        :param entry_filename: source filename of the entry media
+        :return: name of the media's thumbnail in swift
+        """
+        return '%s.thumb.0720.0404.jpg' % entry_filename
 
-                entry_thumb_file = os.path.join(
-                    thumb_temp_dir, _entryThumbFilename
+    def upload_thumbnail_data(self, entity_type, entity_id, data):
+        """
+        Upload a thumbnail held in memory. The API only uploads from a path
+        so it goes through one temporary file, on tmpfs where possible.
+        :param entity_type:
+        :param entity_id:
+        :param data: jpeg contents
+        :return: attachment id
+        """
+        with tempfile.NamedTemporaryFile(
+            suffix='.jpg', dir=THUMBNAIL_TEMP_DIR
+        ) as thumb_file:
+            thumb_file.write(data)
+            thumb_file.flush()
+            return self.upload_thumbnail(
+                entity_type, entity_id, thumb_file.name
+            )
+
+    def _worker_client(self):
+        """
+        A client for another thread, sharing this one's rate limiter, state
+        and swift cache. Clients can not be shared between threads.
+
+        The company, category and vetting list caches and the media
+        registry are shared too, with their locks, when they are loaded
+        already, so workers create a company at most once between them and
+        see the proxies each other upload. Load them before starting the
+        workers, caches not loaded yet are loaded by each worker itself.
+        """
+        client = ShotgunVES(
+            verbose=self.level == logging.DEBUG,
+            state=self.state,
+            rate_limiter=self.rate_limiter,
+            swift_cache=self.swift_cache,
+        )
+        if self._companies is not None:
+            client._companies = self._companies
+            client._company_lock = self._company_lock
+        if self._media is not None:
+            client._media = self._media
+            client._media_lock = self._media_lock
+        client._categories = self._categories
+        client._vetting_list = self._vetting_list
+        return client
+
+    def upload_thumbnails(self, thumbnails, workers=THUMBNAIL_WORKERS):
+        """
+        Upload the swift thumbnails of many versions concurrently, each
+        read into memory and uploaded from there.
+        :param thumbnails: list of (version id, thumbnail object name)
+        :param workers: number of threads
+        :return: ids of the versions whose thumbnail was uploaded
+        """
+        if not thumbnails:
+            return []
+
+        connection = self.get_connection()
+        local = threading.local()
+
+        def upload(thumbnail):
+            version_id, thumb_name = thumbnail
+            if not hasattr(local, 'shotgun'):
+                local.shotgun = self._worker_client()
+                local.connection = swift_transfer.clone_connection(connection)
+            try:
+                data = swift_transfer.read_object(
+                    local.connection, settings.VES_THUMBS_CONTAINER,
+                    thumb_name
+                )
+                local.shotgun.upload_thumbnail_data(
+                    self.shotgun_version_entity, version_id, data
                 )
+            except (ClientException, ShotgunError,
+                    swift_transfer.TransferIntegrityError):
+                self.exception('Could not upload thumbnail %s' % thumb_name)
+                return None
+            return version_id
 
-                f = open(entry_thumb_file, 'wb')
-                _, ob_contents = connection.get_object(
-                    settings.VES_THUMBS_CONTAINER,
-                    _entryThumbFilename,
-                    resp_chunk_size=(1024 * 1024 * 40)
+        pool = ThreadPool(min(workers, len(thumbnails)))
+        try:
+            uploaded = pool.map(upload, thumbnails)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [version_id for version_id in uploaded if version_id]
+
+    def find_versions_missing_thumbnails(self):
+        """
+        Read every version of the project that has a proxy but no image
+        :return: dict of submission code to list of (version id, md5)
+        """
+        missing = {}
+        for version in self.find(
+            self.shotgun_version_entity,
+            [
+                ['image', 'is', None],
+                ['sg_uploaded_movie', 'is_not', None],
+                self._project_filter,
+            ],
+            ['code', 'entity']
+        ):
+            match = MD5_PATTERN.search(version['code'] or '')
+            if not match or not version['entity']:
+                continue
+            missing.setdefault(version['entity']['name'], []).append(
+                (version['id'], match.group(0))
+            )
+        return missing
+
+    def _upload_version_thumbnail(self, entry, version_info, data, name):
+        self.log("Uploading %s" % name)
+        try:
+            # Only marks that there is a thumbnail to share, not its url
+            version_info['image'] = self.upload_thumbnail_data(
+                self.shotgun_version_entity,
+                version_info['id'],
+                data
+            )
+        except ShotgunError:
+            self.exception(
+                "Shotgun Upload Error on entry thumbnail %s "
+                % str(entry.entryNum)
+            )
+
+    @staticmethod
+    def _local_file(source, filename):
+        """
+        A path for a file given as a path or an open file. Files without a
+        usable name are spooled to a temporary directory under filename.
+        :return: (path, temporary directory to remove or None)
+        """
+        if not hasattr(source, 'read'):
+            return source, None
+
+        path = getattr(source, 'name', None)
+        if path and not isinstance(path, int) and os.path.isfile(path):
+            return path, None
+
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, filename)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(source, f)
+        return path, temp_dir
+
+    def attach_proxy(self, entry, md5, proxy, thumbnail=None, aa=True):
+        """
+        Attach a proxy straight from the encode pipeline, without waiting
+        for a sync to find it in swift and download it again.
+        :param entry:
+        :param md5: md5 of the source media the proxy was made from
+        :param proxy: path or open file of the proxy
+        :param thumbnail: path or open file of its thumbnail
+        :param aa: AA media if True, B&A media otherwise
+        :return: 1 if the proxy could not be attached
+        """
+        phase = PHASE_AA_MEDIA if aa else PHASE_BA_MEDIA
+        code = entry.aa_code(md5) if aa else entry.ba_code(md5)
+        self.log('Attaching %s %s' % (entry.entryNum, code))
+
+        submit_info = self.get_submit_info(entry)
+        if submit_info is None:
+            self.log(
+                'Failed to find entry %s details in shotgun, '
+                'not attaching entry media.' % entry.entryNum
+            )
+            return 1
+
+        version_info = self.get_version_info(code)
+        if version_info is None:
+            version_info = self._create_media_version(
+                entry, submit_info, code
+            )
+
+        if not self._requires_upload(version_info, code, md5):
+            self.log("Version %s exists in shotgun, not uploading" % code)
+            if self.state is not None:
+                self.state.record_version(
+                    entry.id, phase, md5, version_info['id']
                 )
+            return
 
-                for chunk in ob_contents:
-                    f.write(chunk)
-                f.close()
+        source = self.find_uploaded_media(md5)
 
-                self.log("Uploading %s" % _entryThumbFilename)
-                try:
-                    self.upload_thumbnail(
-                        self.shotgun_version_entity,
-                        version_info['id'],
-                        entry_thumb_file
+        if self._link_media(entry, version_info, phase, md5, source):
+            self._count_saved(
+                code,
+                None if hasattr(proxy, 'read') else os.path.getsize(proxy)
+            )
+        else:
+            proxy_path, temp_dir = self._local_file(proxy, code)
+            try:
+                if not self._upload_proxy(
+                    entry, version_info, phase, md5, code, proxy_path
+                ):
+                    return 1
+            finally:
+                if temp_dir is not None:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if thumbnail is not None and \
+                not self._share_media_thumbnail(version_info, source):
+            if hasattr(thumbnail, 'read'):
+                thumb_data = thumbnail.read()
+            else:
+                with open(thumbnail, 'rb') as thumb_file:
+                    thumb_data = thumb_file.read()
+            self._upload_version_thumbnail(
+                entry, version_info, thumb_data, '%s thumbnail' % code
+            )
+
+        self.update_run_times(entry)
+
+    @staticmethod
+    def _edited_since(synced, last_edit):
+        """
+        :param synced: sg_soho_updated of the submission
+        :param last_edit: lastEdit of the entry
+        :return: True if the entry changed after the submission was written
+        """
+        if synced is None or last_edit is None:
+            return True
+
+        # Shotgun only keeps whole seconds
+        last_edit = last_edit.replace(microsecond=0)
+
+        if last_edit.tzinfo is None and synced.tzinfo is not None:
+            synced = synced.astimezone(sg_timezone.local).replace(tzinfo=None)
+
+        return synced != last_edit
+
+    @staticmethod
+    def _swift_object_size(connection, container, obj_name):
+        try:
+            headers = connection.head_object(container, obj_name)
+        except ClientException as e:
+            if e.http_status == 404:
+                return None
+            raise
+        return int(headers['content-length'])
+
+    @staticmethod
+    def _swift_object_sizes(connection, container):
+        """
+        :return: dict of object name to size of every object in a container,
+            from its listing a page at a time
+        """
+        _, objects = connection.get_container(container, full_listing=True)
+        return dict((obj['name'], obj['bytes']) for obj in objects)
+
+    def plan_sync(self, entries):
+        """
+        Work out every change a sync of the entries would make. The remote
+        state is read in bulk up front and nothing is written.
+
+        Every existing submission is planned as an update. Edits to people
+        and companies do not change an entry's lastEdit, so it can not tell
+        which submissions are stale, edited says whether the entry itself
+        changed since its last sync.
+        :param entries:
+        :return: SyncPlan
+        """
+        entries = list(entries)
+        plan = SyncPlan()
+
+        submissions = self.find_by_codes(
+            self.shotgun_submission_entity,
+            [str(entry.entryNum) for entry in entries],
+            ['sg_status_list', 'sg_soho_updated']
+        )
+
+        media = []
+
+        for entry in entries:
+            if entry.shotgunSync:
+                continue
+
+            submission = submissions.get(str(entry.entryNum))
+
+            if entry.hasBeenDeleted:
+                if submission is not None and \
+                        submission['sg_status_list'] != WITHDRAWN_STATUS:
+                    plan.add(
+                        SyncPlan.RETIRE, entry, submission_id=submission['id']
                     )
-                    os.unlink(entry_thumb_file)
-                    os.rmdir(thumb_temp_dir)
-                except ShotgunError:
-                    self.exception(
-                        "Shotgun Upload Error on entry thumbnail %s "
-                        % str(entry.entryNum)
+                continue
+
+            if submission is None:
+                plan.add(SyncPlan.CREATE, entry)
+            else:
+                plan.add(
+                    SyncPlan.UPDATE, entry, submission_id=submission['id'],
+                    edited=self._edited_since(
+                        submission['sg_soho_updated'], entry.lastEdit
                     )
+                )
+
+            entry_files = EntryFiles(entry)
+            entry_files.findFiles()
+
+            for phase, aa, found in (
+                (PHASE_AA_MEDIA, True, entry_files.entry_found),
+                (PHASE_BA_MEDIA, False, entry_files.ba_found),
+            ):
+                if not found:
+                    continue
+                entry_md5, entry_filename, code, swift_mp4_name = \
+                    self.get_media_names(entry, entry_files, aa)
+                if entry_md5 is None or entry_filename is None:
+                    continue
+                media.append((
+                    entry, phase, code,
+                    settings.VES_PROXY_CONTAINER, swift_mp4_name
+                ))
+
+            media.append((
+                entry, PHASE_SUPPLEMENTAL, entry.supplemental_code(),
+                settings.VES_PDF_CONTAINER, entry.supplemental_code()
+            ))
+
+        versions = self.find_by_codes(
+            self.shotgun_version_entity,
+            [code for _, _, code, _, _ in media],
+            self.get_version_fields()
+        )
+
+        needed = []
+        for entry, phase, code, container, obj_name in media:
+            version_info = versions.get(code)
+
+            if phase == PHASE_SUPPLEMENTAL:
+                if version_info is not None:
+                    continue
+            elif version_info is not None:
+                sg_uploaded_movie = version_info['sg_uploaded_movie']
+                if sg_uploaded_movie and \
+                        sg_uploaded_movie.get('name') == code:
+                    continue
+            needed.append((entry, phase, code, container, obj_name))
+
+        connection = self.get_connection()
+        # Container to the sizes of the objects needed from it
+        sizes = {}
+        for container in set(item[3] for item in needed):
+            names = set(
+                obj_name for _, _, _, item_container, obj_name in needed
+                if item_container == container
+            )
+            if len(names) > PLAN_HEAD_LIMIT:
+                sizes[container] = self._swift_object_sizes(
+                    connection, container
+                )
             else:
-                self.log(
-                    "Version %s exists in shotgun, not uploading"
-                    % sg_uploaded_movie['name']
+                sizes[container] = dict(
+                    (obj_name, self._swift_object_size(
+                        connection, container, obj_name
+                    ))
+                    for obj_name in names
                 )
-        else:
-            self.log(
-                "Not Present entry MOV for %s - %s"
-                % (entry.entryNum, entry_filename)
+
+        for entry, phase, code, container, obj_name in needed:
+            size = sizes[container].get(obj_name)
+            if size is None:
+                self.debug('%s/%s not found in swift' % (container, obj_name))
+                continue
+
+            plan.add(
+                SyncPlan.UPLOAD, entry, phase=phase, version_code=code,
+                container=container, name=obj_name, bytes=size
             )
 
-        self.update_run_times(entry)
+        return plan
+
+    def execute_plan(self, plan):
+        """
+        Carry out a SyncPlan. Retirements and submission writes are sent
+        in batches, then each entry's uploads run, smallest entry first.
+        Entries deleted from the database since the plan was made are
+        skipped.
+        :param plan:
+        :return: ids of the entries that were skipped
+        """
+        retirements = plan.of_type(SyncPlan.RETIRE)
+        self.withdraw_submissions(
+            [planned['submission_id'] for planned in retirements]
+        )
+        self.log('Retired %s submissions' % len(retirements))
+
+        writes = plan.of_type(SyncPlan.CREATE) + plan.of_type(SyncPlan.UPDATE)
+        uploads = plan.of_type(SyncPlan.UPLOAD)
+
+        entry_ids = set(planned['entry_id'] for planned in writes + uploads)
+        entries = dict(
+            (entry.id, entry)
+            for entry in stream_entries(Entry.objects.filter(id__in=entry_ids))
+        )
+
+        missing = sorted(entry_ids - set(entries))
+        if missing:
+            self.error(
+                'Skipping entries no longer in the database: %s'
+                % ', '.join(str(entry_id) for entry_id in missing)
+            )
+            writes = [
+                planned for planned in writes
+                if planned['entry_id'] in entries
+            ]
+            uploads = [
+                planned for planned in uploads
+                if planned['entry_id'] in entries
+            ]
+
+        requests = []
+        for planned in writes:
+            submit_data = self.build_submission_data(
+                entries[planned['entry_id']]
+            )
+            if planned['action'] == SyncPlan.CREATE:
+                requests.append({
+                    'request_type': 'create',
+                    'entity_type': self.shotgun_submission_entity,
+                    'data': submit_data,
+                })
+            else:
+                requests.append({
+                    'request_type': 'update',
+                    'entity_type': self.shotgun_submission_entity,
+                    'entity_id': planned['submission_id'],
+                    'data': submit_data,
+                })
+
+        results = self._batch_in_chunks(requests)
+        self.log('Wrote %s submissions' % len(results))
+
+        for planned, submission in zip(writes, results):
+            self.update_entry_slates(entries[planned['entry_id']], submission)
+
+        upload_phases = {}
+        upload_bytes = {}
+        for planned in uploads:
+            entry_id = planned['entry_id']
+            upload_phases.setdefault(entry_id, set()).add(planned['phase'])
+            upload_bytes[entry_id] = \
+                upload_bytes.get(entry_id, 0) + planned['bytes']
+
+        for entry_id in sorted(upload_bytes, key=upload_bytes.get):
+            self.sync_entry(entries[entry_id], upload_phases[entry_id])
+
+        return missing
 
     def update_run_times(self, entry):
         self.log('Updating %s run times ' % entry.entryNum)
@@ -785,29 +2130,181 @@ class ShotgunVES(Shotgun):
             ['sg_entry_run_time', 'sg_ba_run_time', 'sg_total_run_time']
         )
 
-        et_entry_runtime = entry_totals['sg_entry_run_time']
-        et_ba_runtime = entry_totals['sg_ba_run_time']
-
-        if et_entry_runtime is not None and et_ba_runtime is None:
+        total = self.expected_total_run_time(
+            entry_totals['sg_entry_run_time'], entry_totals['sg_ba_run_time']
+        )
+        if total is not None and total != entry_totals['sg_total_run_time']:
             self.update(
                 self.shotgun_submission_entity, entry_totals['id'],
-                {'sg_total_run_time': et_entry_runtime}
+                {'sg_total_run_time': total}
             )
-        elif et_entry_runtime is None and et_ba_runtime is not None:
-            self.update(
-                self.shotgun_submission_entity, entry_totals['id'],
-                {'sg_total_run_time': et_ba_runtime}
+
+    @staticmethod
+    def expected_total_run_time(entry_run_time, ba_run_time):
+        """
+        :return: the AA and B&A run times added up, None if neither is set
+        """
+        if entry_run_time is None and ba_run_time is None:
+            return None
+        return (entry_run_time or 0) + (ba_run_time or 0)
+
+    def reconcile_run_times(self, dry_run=False):
+        """
+        Check the total run time of every submission in the project against
+        its AA and B&A run times, in one read, and batch update the ones
+        that differ.
+        :param dry_run: only report the submissions that differ
+        :return: dict of the number checked and the codes of the submissions
+            that differed
+        """
+        submissions = self.find(
+            self.shotgun_submission_entity,
+            [self._project_filter],
+            ['code', 'sg_entry_run_time', 'sg_ba_run_time',
+             'sg_total_run_time']
+        )
+
+        expected = [
+            self.expected_total_run_time(
+                submission['sg_entry_run_time'], submission['sg_ba_run_time']
             )
-        elif et_entry_runtime is not None and et_ba_runtime is not None:
-            self.update(
-                self.shotgun_submission_entity, entry_totals['id'],
-                {'sg_total_run_time': (et_entry_runtime + et_ba_runtime)}
+            for submission in submissions
+        ]
+        differing = [
+            (submission, total)
+            for submission, total in zip(submissions, expected)
+            if total is not None and total != submission['sg_total_run_time']
+        ]
+
+        self.log(
+            '%s of %s submission run times differ'
+            % (len(differing), len(submissions))
+        )
+        if differing and not dry_run:
+            self._batch_in_chunks([
+                {
+                    'request_type': 'update',
+                    'entity_type': self.shotgun_submission_entity,
+                    'entity_id': submission['id'],
+                    'data': {'sg_total_run_time': total},
+                }
+                for submission, total in differing
+            ])
+
+        return {
+            'checked': len(submissions),
+            'differed': [submission['code'] for submission, _ in differing],
+        }
+
+    def has_category_aggregate_fields(self):
+        """
+        Check once per run that the Shot schema has the aggregate fields
+        :return: bool
+        """
+        if self._has_category_aggregates is None:
+            fields = self.schema_field_read('Shot')
+            missing = [
+                field for field in CATEGORY_AGGREGATE_FIELDS
+                if field not in fields
+            ]
+            if missing:
+                self.error(
+                    'Shot has no %s fields, not updating category '
+                    'aggregates' % ', '.join(missing)
+                )
+            self._has_category_aggregates = not missing
+        return self._has_category_aggregates
+
+    def update_category_aggregates(self, category_numbers=None):
+        """
+        Work out the number of submissions and their total and mean run
+        time for each category, from one read of the submissions, and
+        batch update the category Shots whose figures changed. Withdrawn
+        submissions are not screened so are not counted.
+        :param category_numbers: only these categories, all by default
+        :return: codes of the categories that were updated
+        """
+        if not self.has_category_aggregate_fields():
+            return []
+
+        filters = [
+            ['sg_category_number', 'is_not', None], self._project_filter
+        ]
+        if category_numbers is not None:
+            if not category_numbers:
+                return []
+            filters.append(
+                ['sg_category_number', 'in', list(category_numbers)]
             )
+        categories = self.find(
+            'Shot', filters,
+            ['code', 'sg_category_number'] + CATEGORY_AGGREGATE_FIELDS
+        )
+        if not categories:
+            return []
+
+        submissions = self.find(
+            self.shotgun_submission_entity,
+            [
+                self._project_filter,
+                ['sg_status_list', 'is_not', WITHDRAWN_STATUS],
+                ['sg_category', 'in', [
+                    {'type': 'Shot', 'id': category['id']}
+                    for category in categories
+                ]],
+            ],
+            ['sg_category', 'sg_total_run_time']
+        )
+
+        # category id to [submission count, run time total, run times]
+        totals = dict(
+            (category['id'], [0, 0, 0]) for category in categories
+        )
+        for submission in submissions:
+            category_totals = totals.get(submission['sg_category']['id'])
+            if category_totals is None:
+                continue
+            category_totals[0] += 1
+            if submission['sg_total_run_time'] is not None:
+                category_totals[1] += submission['sg_total_run_time']
+                category_totals[2] += 1
+
+        changed = []
+        for category in categories:
+            count, total, timed = totals[category['id']]
+            data = {
+                'sg_submission_count': count,
+                'sg_total_run_time': total,
+                'sg_mean_run_time':
+                    int(round(total / float(timed))) if timed else 0,
+            }
+            if any(category.get(field) != data[field] for field in data):
+                changed.append((category, data))
 
-    def update_supplemental(self, entry):
+        self.log(
+            'Updating aggregates of %s of %s categories'
+            % (len(changed), len(categories))
+        )
+        self._batch_in_chunks([
+            {
+                'request_type': 'update',
+                'entity_type': 'Shot',
+                'entity_id': category['id'],
+                'data': data,
+            }
+            for category, data in changed
+        ])
+        return [category['code'] for category, _ in changed]
+
+    def update_supplemental(self, entry, context=None):
         self.log('Updating supplemental materials for ' + str(entry.entryNum))
 
-        submit_info = self.get_submit_info(entry)
+        if context is None:
+            context = self.get_sync_context(
+                entry, [PHASE_SUPPLEMENTAL], skip_synced=False
+            )
+
+        submit_info = context['submit_info']
         if submit_info is None:  # no entry exists, fail
             self.log(
                 'Failed to find entry %s in shotgun, not uploading '
@@ -815,15 +2312,19 @@ class ShotgunVES(Shotgun):
             )
             return 1
 
-        self.log("Submit Info:")
-        self.log(pformat(submit_info))
+        self.log_data("Submit Info:", submit_info, self.level)
 
-        version_info = self.get_version_info(entry.supplemental_code())
+        version_info = context['versions'].get(entry.supplemental_code())
         if version_info is not None:  # no version exists, create
             self.log(
                 'Supplemental %s exists in shotgun.'
                 % entry.entryNum
             )
+            if self.state is not None:
+                self.state.record_version(
+                    entry.id, PHASE_SUPPLEMENTAL, entry.supplemental_code(),
+                    version_info['id']
+                )
             return
 
         self.log(
@@ -842,50 +2343,39 @@ class ShotgunVES(Shotgun):
             },
         )
 
-        self.log("Version Info:")
-        self.log(pformat(version_info))
+        self.log_data("Version Info:", version_info, self.level)
 
         _pdf_supplemental_filename = entry.supplemental_code()
 
         try:
             connection = self.get_connection()
             try:
-                connection.head_object(
-                    settings.VES_PDF_CONTAINER,
-                    _pdf_supplemental_filename,
-                )
-                _, ob_contents = connection.get_object(
+                with self.swift_cache.pinned(
+                    connection,
                     settings.VES_PDF_CONTAINER,
                     _pdf_supplemental_filename,
-                    resp_chunk_size=(1024 * 1024 * 40)
-                )
+                    filename=entry.supplemental_code()
+                ) as pdf_file:
+                    self.log("Uploading " + _pdf_supplemental_filename)
 
-                temp_dir = tempfile.mkdtemp()
-                pdf_file = os.path.join(temp_dir, entry.supplemental_code())
-
-                f = open(pdf_file, 'wb')
-
-                for chunk in ob_contents:
-                    f.write(chunk)
-                f.close()
-
-                self.log("Uploading " + _pdf_supplemental_filename)
-
-                self.upload(
-                    self.shotgun_version_entity,
-                    version_info['id'],
-                    pdf_file,
-                    "sg_uploaded_movie",
-                    entry.supplemental_code()
-                )
+                    self.upload(
+                        self.shotgun_version_entity,
+                        version_info['id'],
+                        pdf_file,
+                        "sg_uploaded_movie",
+                        entry.supplemental_code()
+                    )
 
                 self.log(
                     "PDF %s uploaded to shotgun."
                     % _pdf_supplemental_filename
                 )
 
-                os.unlink(pdf_file)
-                os.rmdir(temp_dir)
+                if self.state is not None:
+                    self.state.record_version(
+                        entry.id, PHASE_SUPPLEMENTAL,
+                        entry.supplemental_code(), version_info['id']
+                    )
 
             except ClientException as e:
                 if e.http_status == 404:
@@ -902,3 +2392,648 @@ class ShotgunVES(Shotgun):
                 % entry.entryNum
             )
             return 1
+
+    def _event_types(self):
+        entity_types = (
+            self.shotgun_submission_entity,
+            self.shotgun_version_entity,
+            'HumanUser',
+            self.shotgun_company_entity,
+        )
+        return [
+            'Shotgun_%s_%s' % (entity_type, change)
+            for entity_type in entity_types
+            for change in ('New', 'Change', 'Retirement', 'Revival')
+        ]
+
+    def get_api_user(self):
+        """
+        The ApiUser this script connects to shotgun as
+        :return: ApiUser entity, None if it can not be found
+        """
+        if self._api_user is None:
+            self._api_user = self.find_one(
+                'ApiUser', [['firstname', 'is', settings.SHOTGUN_USER]],
+                ['id']
+            )
+        return self._api_user
+
+    def _find_including_retired(self, entity_type, entity_ids, fields):
+        if not entity_ids:
+            return []
+        filters = [['id', 'in', list(entity_ids)]]
+        return (
+            self.find(entity_type, filters, fields) +
+            self.find(entity_type, filters, fields, retired_only=True)
+        )
+
+    @staticmethod
+    def _read_event_cursor(cursor_path):
+        try:
+            with open(cursor_path) as cursor_file:
+                return int(cursor_file.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_event_cursor(cursor_path, event_id):
+        temp_path = '%s.tmp' % cursor_path
+        with open(temp_path, 'w') as cursor_file:
+            cursor_file.write(str(event_id))
+        os.rename(temp_path, cursor_path)
+
+    def poll_events(self, cursor_path=EVENT_CURSOR_PATH):
+        """
+        Read the shotgun event log since the persisted cursor for changes
+        made in shotgun to submissions, versions, people and companies.
+
+        Company changes drop the company cache. Everything else is mapped
+        back to the submissions it affects so those entries can be resynced.
+        Changes the sync made itself, as the script's ApiUser, are left out.
+        Deleted submissions and versions are dropped from the sync state.
+        The first poll only records the latest event as the cursor.
+        :param cursor_path: file holding the last event id seen
+        :return: set of affected entry codes
+        """
+        cursor = self._read_event_cursor(cursor_path)
+
+        if cursor is None:
+            latest = self.find_one(
+                'EventLogEntry', [], ['id'],
+                order=[{'field_name': 'id', 'direction': 'desc'}]
+            )
+            self._write_event_cursor(
+                cursor_path, latest['id'] if latest else 0
+            )
+            return set()
+
+        filters = [
+            ['event_type', 'in', self._event_types()],
+            {
+                'filter_operator': 'any',
+                'filters': [
+                    self._project_filter,
+                    ['project', 'is', None],
+                ]
+            },
+        ]
+        api_user = self.get_api_user()
+        if api_user is not None:
+            filters.append(
+                ['user', 'is_not', {'type': 'ApiUser', 'id': api_user['id']}]
+            )
+        else:
+            self.error(
+                'ApiUser %s not found, polling includes our own changes'
+                % settings.SHOTGUN_USER
+            )
+        fields = ['event_type', 'entity', 'meta', 'attribute_name']
+
+        changed = dict(
+            (entity_type, set()) for entity_type in (
+                self.shotgun_submission_entity,
+                self.shotgun_version_entity,
+                'HumanUser',
+                self.shotgun_company_entity,
+            )
+        )
+
+        retired = dict((entity_type, set()) for entity_type in changed)
+
+        while True:
+            events = self.find(
+                'EventLogEntry',
+                filters + [['id', 'greater_than', cursor]],
+                fields,
+                order=[{'field_name': 'id', 'direction': 'asc'}],
+                limit=EVENT_PAGE_SIZE
+            )
+            for event in events:
+                _, entity_type, change = event['event_type'].split('_', 2)
+                entity_id = (event['entity'] or {}).get('id') or \
+                    (event['meta'] or {}).get('entity_id')
+                if entity_id is not None:
+                    changed[entity_type].add(entity_id)
+                    if change == 'Retirement':
+                        retired[entity_type].add(entity_id)
+                cursor = event['id']
+
+            if len(events) < EVENT_PAGE_SIZE:
+                break
+
+        if changed[self.shotgun_company_entity]:
+            self._companies = None
+
+        # The sync state would otherwise skip media and details whose
+        # shotgun side is gone
+        if self.state is not None:
+            self.state.forget_submissions(
+                retired[self.shotgun_submission_entity]
+            )
+            self.state.forget_versions(retired[self.shotgun_version_entity])
+
+        submission_ids = set(changed[self.shotgun_submission_entity])
+
+        for version in self._find_including_retired(
+            self.shotgun_version_entity,
+            changed[self.shotgun_version_entity], ['entity']
+        ):
+            submission = version['entity']
+            if submission and \
+                    submission['type'] == self.shotgun_submission_entity:
+                submission_ids.add(submission['id'])
+
+        codes = set(
+            submission['code'] for submission in self._find_including_retired(
+                self.shotgun_submission_entity, submission_ids, ['code']
+            )
+        )
+
+        user_ids = list(changed['HumanUser'])
+        if user_ids:
+            users = [
+                {'type': 'HumanUser', 'id': user_id} for user_id in user_ids
+            ]
+            submissions = self.find(
+                self.shotgun_submission_entity,
+                [
+                    self._project_filter,
+                    {
+                        'filter_operator': 'any',
+                        'filters': [
+                            ['sg_contact', 'in', users],
+                            ['sg_submitter_list', 'in', users],
+                            ['sg_signature_list', 'in', users],
+                        ]
+                    },
+                ],
+                ['code']
+            )
+            codes.update(submission['code'] for submission in submissions)
+
+        self._write_event_cursor(cursor_path, cursor)
+
+        if codes:
+            self.log('Shotgun changes affect entries %s' % sorted(codes))
+        return codes
+
+
+def stream_entries(queryset=None):
+    """
+    Iterate entries with their people and category joined in, so an entry
+    costs no queries of its own, without the queryset caching every entry.
+    The database streams the rows in chunks from a server side cursor.
+    :param queryset: entries to stream, defaults to all of them
+    :return: iterator of entries
+    """
+    if queryset is None:
+        queryset = Entry.objects.all()
+    return queryset.select_related(*ENTRY_RELATED_FIELDS).iterator()
+
+
+def sync_entries(entry_ids, shotgun=None, phases=ALL_PHASES, run_name=None,
+                 skip_synced=True):
+    """
+    Sync the given entries to shotgun one after another, in id order.
+
+    With a sync state store and a run name the run records the entry and
+    phase it is on, and a rerun after a crash starts again from there.
+    With SHOTGUN_PROFILE set the run and its slowest entries are profiled.
+    :param entry_ids:
+    :param shotgun: ShotgunVES to use, a new one is created if not given
+    :param phases: phases to sync, all of them by default
+    :param run_name: name to record the run's position under
+    :param skip_synced: see ShotgunVES.sync_entry
+    :return: summary dict of synced and failed entry ids and bytes saved
+        by linking media already in shotgun
+    """
+    if shotgun is None:
+        shotgun = ShotgunVES(state=get_sync_state())
+    shotgun.run_name = run_name
+    entry_ids = list(entry_ids)
+    shotgun.run_fingerprint = entries_fingerprint(entry_ids)
+
+    summary = {'synced': [], 'failed': [], 'bytes_saved': 0}
+    bytes_saved = shotgun.bytes_saved
+    category_numbers = set()
+
+    queryset = Entry.objects.filter(id__in=entry_ids).order_by('id')
+
+    state = shotgun.state
+    if state is not None and run_name:
+        position = state.run_position(run_name, shotgun.run_fingerprint)
+        if position is not None:
+            shotgun.log(
+                'Resuming run %s at entry %s phase %s'
+                % (run_name, position[0], position[1])
+            )
+            queryset = queryset.filter(id__gte=position[0])
+
+    with RunProfiler(run_name or 'sync_entries') as profiler:
+        for entry in stream_entries(queryset):
+            try:
+                category_numbers.add(entry.entryNum.category.catNum)
+                with profiler.entry(str(entry.entryNum)):
+                    failed = shotgun.sync_entry(entry, phases, skip_synced)
+                if failed:
+                    summary['failed'].append(entry.id)
+                else:
+                    summary['synced'].append(entry.id)
+            except Exception:
+                shotgun.exception('Could not sync %s' % entry)
+                summary['failed'].append(entry.id)
+
+    if state is not None and run_name:
+        state.finish_run(run_name)
+
+    _refresh_category_aggregates(shotgun, category_numbers)
+
+    summary['bytes_saved'] = shotgun.bytes_saved - bytes_saved
+    return summary
+
+
+def _refresh_category_aggregates(shotgun, category_numbers):
+    if not CATEGORY_AGGREGATES:
+        return
+    # The entries are already synced, out of date aggregates are caught
+    # by the next run
+    try:
+        shotgun.update_category_aggregates(category_numbers)
+    except Exception:
+        shotgun.exception('Could not update category aggregates')
+
+
+def _scheduled_context(shotgun, entry, phases, contexts):
+    if shotgun.update_entry_status(entry):
+        # Entry has been deleted or marked as do not continue
+        contexts[entry.id] = {'phases': []}
+        return
+    context = shotgun.get_sync_context(entry, phases)
+    contexts[entry.id] = context
+    if PHASE_DETAILS in context['phases']:
+        shotgun.update_entry_details(entry, context, slates=False)
+
+
+def _scheduled_slates(shotgun, entry, contexts):
+    context = contexts[entry.id]
+    if PHASE_DETAILS in context['phases'] and context['submit_info']:
+        shotgun.update_entry_slates(entry, context['submit_info'])
+
+
+def _scheduled_phase(shotgun, entry, phase, contexts):
+    context = contexts[entry.id]
+    if phase not in context['phases']:
+        return
+    if phase == PHASE_AA_MEDIA:
+        result = shotgun.update_entry_media(entry, context)
+    elif phase == PHASE_BA_MEDIA:
+        result = shotgun.update_ba_media(entry, context)
+    elif phase == PHASE_SUPPLEMENTAL:
+        result = shotgun.update_supplemental(entry, context)
+    # Phases return 1 on failure, raise so the task fails
+    if result == 1:
+        raise Exception('Could not sync %s %s' % (entry.entryNum, phase))
+
+
+def _scheduled_run_times(shotgun, entry, contexts):
+    if contexts[entry.id].get('run_times_changed'):
+        shotgun.update_run_times(entry)
+
+
+def scheduled_sync(entry_ids, phases=ALL_PHASES, workers=None):
+    """
+    Sync the entries with each kind of work in its own priority lane, so
+    submission details are never stuck behind proxy transfers. Details
+    and status go first, then slates, supplemental PDFs and proxies. The
+    later phases of an entry wait for its details.
+    :param entry_ids:
+    :param phases: phases to sync, all of them by default
+    :param workers: number of worker threads
+    :return: summary dict of synced and failed entry ids
+    """
+    shotgun = ShotgunVES(state=get_sync_state())
+    # Loaded once here and shared by every worker's client
+    shotgun.warm_read_caches()
+    shotgun.load_media_registry()
+
+    def close_connections(worker):
+        # Each worker thread has its own database connections
+        for connection in connections.all():
+            connection.close()
+
+    profiler = RunProfiler('scheduled_sync')
+    lanes = scheduler.LaneScheduler(
+        workers=workers or scheduler.SCHEDULER_WORKERS,
+        worker_init=shotgun._worker_client,
+        worker_exit=close_connections,
+        profiler=profiler,
+    )
+
+    contexts = {}
+    entry_tasks = {}
+    category_numbers = set()
+    queryset = Entry.objects.filter(id__in=entry_ids).order_by('id')
+    for entry in stream_entries(queryset):
+        name = str(entry.entryNum)
+        try:
+            category_numbers.add(entry.entryNum.category.catNum)
+        except Exception:
+            # The sync itself reports the entry as failed
+            shotgun.exception('Could not read the category of %s' % entry)
+        details = lanes.add(
+            scheduler.LANE_METADATA, _scheduled_context,
+            (entry, phases, contexts), name='%s details' % name
+        )
+        tasks = [details]
+        if PHASE_DETAILS in phases:
+            tasks.append(lanes.add(
+                scheduler.LANE_SLATES, _scheduled_slates,
+                (entry, contexts), after=[details], name='%s slates' % name
+            ))
+        if PHASE_SUPPLEMENTAL in phases:
+            tasks.append(lanes.add(
+                scheduler.LANE_SUPPLEMENTAL, _scheduled_phase,
+                (entry, PHASE_SUPPLEMENTAL, contexts), after=[details],
+                name='%s supplemental' % name
+            ))
+        media = [
+            lanes.add(
+                scheduler.LANE_PROXIES, _scheduled_phase,
+                (entry, phase, contexts), after=[details],
+                name='%s %s' % (name, phase)
+            )
+            for phase in (PHASE_AA_MEDIA, PHASE_BA_MEDIA) if phase in phases
+        ]
+        tasks.extend(media)
+        if media:
+            tasks.append(lanes.add(
+                scheduler.LANE_METADATA, _scheduled_run_times,
+                (entry, contexts), after=media, name='%s run times' % name
+            ))
+        entry_tasks[entry.id] = tasks
+
+    with profiler:
+        lanes.run()
+
+    _refresh_category_aggregates(shotgun, category_numbers)
+
+    summary = {'synced': [], 'failed': []}
+    for entry_id, tasks in sorted(entry_tasks.items()):
+        if all(task.status == scheduler.Task.DONE for task in tasks):
+            summary['synced'].append(entry_id)
+        else:
+            summary['failed'].append(entry_id)
+    return summary
+
+
+def resync_from_events(cursor_path=EVENT_CURSOR_PATH):
+    """
+    Resync just the entries that were changed in shotgun since the last poll
+    :param cursor_path:
+    :return: sync_entries summary
+    """
+    shotgun = ShotgunVES(state=get_sync_state())
+    codes = shotgun.poll_events(cursor_path)
+    if not codes:
+        return {'synced': [], 'failed': [], 'bytes_saved': 0}
+
+    entry_ids = [
+        entry.id
+        for entry in Entry.objects.select_related('entryNum').iterator()
+        if str(entry.entryNum) in codes
+    ]
+    # Shotgun side edits leave lastEdit as it was, so nothing is skipped
+    return sync_entries(entry_ids, shotgun, skip_synced=False)
+
+
+def backfill_thumbnails(workers=THUMBNAIL_WORKERS):
+    """
+    Upload the thumbnail of every version that has a proxy but no image,
+    without sending any of the movies again
+    :param workers: number of upload threads
+    :return: summary dict of missing, uploaded and skipped version ids
+    """
+    shotgun = ShotgunVES()
+    missing = shotgun.find_versions_missing_thumbnails()
+    summary = {'missing': [], 'uploaded': [], 'skipped': []}
+    if not missing:
+        return summary
+
+    thumbnails = []
+    for entry in Entry.objects.select_related('entryNum').iterator():
+        versions = missing.pop(str(entry.entryNum), None)
+        if not versions:
+            continue
+
+        entry_files = EntryFiles(entry)
+        entry_files.findFiles()
+        entry_md5s = set([
+            entry_files.getUserEntryMD5(), entry_files.getUserBaMD5()
+        ])
+
+        for version_id, md5 in versions:
+            summary['missing'].append(version_id)
+            # Thumbnails are only kept for the entry's current media
+            if not entry_files.entry_name or md5 not in entry_md5s:
+                summary['skipped'].append(version_id)
+                continue
+            thumbnails.append((
+                version_id, shotgun.get_thumbnail_name(
+                    os.path.basename(entry_files.entry_name)
+                )
+            ))
+
+    for versions in missing.values():
+        ids = [version_id for version_id, _ in versions]
+        summary['missing'].extend(ids)
+        summary['skipped'].extend(ids)
+
+    shotgun.log(
+        'Backfilling %s thumbnails, skipping %s'
+        % (len(thumbnails), len(summary['skipped']))
+    )
+    summary['uploaded'] = shotgun.upload_thumbnails(thumbnails, workers)
+    return summary
+
+
+def reconcile_run_times(dry_run=False):
+    """
+    Correct the total run time of every submission that does not match its
+    AA and B&A run times, e.g. after a missed or failed sync
+    :param dry_run: only report the submissions that differ
+    :return: summary dict of the number checked and the codes that differed
+    """
+    return ShotgunVES().reconcile_run_times(dry_run=dry_run)
+
+
+def retire_deleted_entries():
+    """
+    Withdraw the submission of every deleted entry in one pass, rather
+    than syncing each entry
+    :return: dict of retired, already withdrawn and missing entry codes
+    """
+    return ShotgunVES().retire_deleted_entries()
+
+
+def update_category_aggregates(category_numbers=None):
+    """
+    Refresh the submission count and run time totals of the category Shots
+    :param category_numbers: only these categories, all by default
+    :return: codes of the categories that were updated
+    """
+    return ShotgunVES().update_category_aggregates(category_numbers)
+
+
+def plan_entries(entry_ids=None, dry_run=True):
+    """
+    Plan a sync of the entries, all of them by default, and run the plan
+    unless this is a dry run
+    :param entry_ids:
+    :param dry_run:
+    :return: SyncPlan
+    """
+    if entry_ids is None:
+        queryset = Entry.objects.all()
+    else:
+        queryset = Entry.objects.filter(id__in=entry_ids)
+
+    shotgun = ShotgunVES()
+    plan = shotgun.plan_sync(stream_entries(queryset))
+    shotgun.log('Sync plan: %s' % plan.summary())
+
+    if not dry_run:
+        shotgun.execute_plan(plan)
+
+    return plan
+
+
+def partition_entries(shards, by_category=True):
+    """
+    Split every entry id into shards.
+
+    By category keeps a category's entries together and balances shards by
+    entry count, otherwise entries are spread by id. Entries added or
+    deleted since move categories between shards, so a failed shard is
+    rerun from its entry ids rather than by number.
+    :param shards: number of shards
+    :param by_category:
+    :return: dict of shard number to entry ids
+    """
+    partitions = dict((shard, []) for shard in range(shards))
+    rows = Entry.objects.order_by('id').values_list(
+        'id', 'entryNum__category__catNum'
+    )
+
+    if not by_category:
+        for entry_id, _ in rows:
+            partitions[entry_id % shards].append(entry_id)
+        return partitions
+
+    categories = {}
+    for entry_id, cat_num in rows:
+        categories.setdefault(cat_num, []).append(entry_id)
+
+    # Largest categories first onto the least loaded shard
+    for cat_num, entry_ids in sorted(
+        categories.items(), key=lambda item: (-len(item[1]), item[0])
+    ):
+        shard = min(partitions, key=lambda s: (len(partitions[s]), s))
+        partitions[shard].extend(entry_ids)
+
+    return partitions
+
+
+def _sync_shard(shard, entry_ids, caches_path):
+    shotgun = ShotgunVES(state=get_sync_state())
+    with open(caches_path) as caches_file:
+        shotgun.load_read_caches(json.load(caches_file))
+
+    shotgun.log('Shard %s syncing %s entries' % (shard, len(entry_ids)))
+    summary = sync_entries(entry_ids, shotgun, run_name='shard_%s' % shard)
+    summary['shard'] = shard
+    return summary
+
+
+def sharded_sync(shards=4, processes=None, by_category=True,
+                 partitions=None):
+    """
+    Full sync of every entry split across a process pool. Each worker gets
+    its own ShotgunVES, seeded with read caches warmed once here and shared
+    through a json file.
+
+    Shards that fail are listed in the summary's failed_shards and their
+    entry ids in failed_shard_entries, pass that as partitions to rerun just
+    those entries.
+    :param shards: number of shards to split the entries into
+    :param processes: pool size, defaults to the number of shards run
+    :param by_category: shard by category number instead of by entry id
+    :param partitions: dict of shard number to entry ids to run instead of
+        partitioning every entry
+    :return: summary dict
+    """
+    if partitions is None:
+        partitions = partition_entries(shards, by_category)
+
+    shotgun = ShotgunVES()
+    shotgun.warm_read_caches()
+
+    # Each process only has its own copy of the company cache, so companies
+    # new in this run are created here once rather than in every shard
+    companies = set()
+    for shard_entry_ids in partitions.values():
+        for start in range(0, len(shard_entry_ids), BATCH_SIZE):
+            companies.update(chain.from_iterable(
+                Entry.objects.filter(
+                    id__in=shard_entry_ids[start:start + BATCH_SIZE],
+                    shotgunSync=False, hasBeenDeleted=False,
+                ).values_list('productionCompany', 'distributionCompany')
+            ))
+    shotgun.create_missing_companies(companies)
+
+    caches_fd, caches_path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(caches_fd, 'w') as caches_file:
+        json.dump(shotgun.export_read_caches(), caches_file)
+
+    # Workers must open their own database connections
+    for connection in connections.all():
+        connection.close()
+
+    summary = {
+        'synced': [], 'failed': [], 'failed_shards': [],
+        'failed_shard_entries': {}, 'shards': shards, 'bytes_saved': 0,
+    }
+
+    pool = multiprocessing.Pool(processes or len(partitions) or 1)
+    try:
+        results = dict(
+            (shard, pool.apply_async(
+                _sync_shard, (shard, entry_ids, caches_path)
+            ))
+            for shard, entry_ids in partitions.items()
+        )
+        pool.close()
+
+        for shard, result in sorted(results.items()):
+            try:
+                shard_summary = result.get()
+            except Exception:
+                logger.exception('Shard %s failed' % shard)
+                summary['failed_shards'].append(shard)
+                summary['failed_shard_entries'][shard] = partitions[shard]
+                continue
+            summary['synced'].extend(shard_summary['synced'])
+            summary['failed'].extend(shard_summary['failed'])
+            summary['bytes_saved'] += shard_summary['bytes_saved']
+
+        pool.join()
+    finally:
+        pool.terminate()
+        os.unlink(caches_path)
+
+    logger.info(
+        'Sharded sync done, %s synced, %s failed, failed shards %s' % (
+            len(summary['synced']), len(summary['failed']),
+            summary['failed_shards']
+        )
+    )
+    return summary
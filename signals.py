@@ -0,0 +1,240 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_init, post_save
+
+from shotgun_v2 import (
+    PHASE_AA_MEDIA, PHASE_BA_MEDIA, PHASE_DETAILS, PHASE_SUPPLEMENTAL,
+    ShotgunVES, stream_entries
+)
+from sync_state import get_sync_state
+from ves.awards.models import Entry
+
+logger = logging.getLogger(__name__)
+
+# An entry is synced once it has been quiet this many seconds, or once its
+# first unsynced change is this old, whichever comes first.
+SYNC_DEBOUNCE_SECONDS = getattr(settings, 'SHOTGUN_SYNC_DEBOUNCE_SECONDS', 30)
+SYNC_MAX_WAIT_SECONDS = getattr(settings, 'SHOTGUN_SYNC_MAX_WAIT_SECONDS', 300)
+
+# Entry field name to the phases beyond details a change to it needs. The
+# version and supplemental codes are made from the entry number. The media
+# itself is in swift rather than on the entry, the encode pipeline reports
+# new media with mark_changed.
+SYNC_FIELD_PHASES = getattr(settings, 'SHOTGUN_SYNC_FIELD_PHASES', {
+    'entryNum': [PHASE_AA_MEDIA, PHASE_BA_MEDIA, PHASE_SUPPLEMENTAL],
+})
+
+# Entry fields pointing at the people sent to shotgun
+PERSON_FIELDS = (
+    'entrant1', 'entrant2', 'entrant3', 'entrant4', 'entrant5',
+    'submittingEntrant', 'entrantVFX', 'entrantFacilityMgr',
+    'submissionContact',
+)
+
+
+class SyncCoalescer(object):
+    """
+    Collects the phases each entry needs synced and dispatches them once the
+    entry settles, so a burst of saves becomes one sync of the union of
+    their phases.
+
+    One flush syncs at a time, with a client kept for the coalescer's
+    life whose read caches are dropped at the start of each flush. Changes
+    made while it runs wait for the next flush, which is scheduled once it
+    finishes, so an entry is never synced twice at once.
+
+    Changes are only coalesced within one process. Each web worker has a
+    coalescer of its own, so saves of one entry handled by different
+    workers are synced by each of them.
+    """
+
+    def __init__(self, debounce=SYNC_DEBOUNCE_SECONDS,
+                 max_wait=SYNC_MAX_WAIT_SECONDS):
+        self.debounce = debounce
+        self.max_wait = max_wait
+        # entry id to [phases, first change time, last change time]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        # Held while a flush syncs, guards the client too
+        self._flush_lock = threading.Lock()
+        self._shotgun = None
+
+    def add(self, entry_id, phases):
+        now = time.time()
+        with self._lock:
+            pending = self._pending.get(entry_id)
+            if pending is None:
+                self._pending[entry_id] = [set(phases), now, now]
+            else:
+                pending[0].update(phases)
+                pending[2] = now
+            self._schedule(self.debounce)
+
+    def _schedule(self, delay):
+        # Called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _schedule_next(self):
+        # Called with the lock held
+        next_due = None
+        for phases, first, last in self._pending.values():
+            due = min(last + self.debounce, first + self.max_wait)
+            if next_due is None or due < next_due:
+                next_due = due
+        if next_due is not None:
+            self._schedule(max(next_due - time.time(), 0))
+
+    def flush(self, force=False):
+        """
+        Sync every entry that is due, all pending entries if force is set.
+        Without force this does nothing while another flush is syncing.
+        :param force: also wait for a flush in progress to finish
+        """
+        with self._lock:
+            self._timer = None
+
+        # The flush in progress schedules the next one when it is done
+        if not self._flush_lock.acquire(force):
+            return
+
+        try:
+            now = time.time()
+            ready = {}
+            with self._lock:
+                for entry_id, (phases, first, last) in \
+                        list(self._pending.items()):
+                    due = min(last + self.debounce, first + self.max_wait)
+                    if force or due <= now:
+                        ready[entry_id] = phases
+                        del self._pending[entry_id]
+
+            if ready:
+                self._sync(ready)
+        finally:
+            self._flush_lock.release()
+            with self._lock:
+                self._schedule_next()
+
+    def _sync(self, ready):
+        try:
+            if self._shotgun is None:
+                self._shotgun = ShotgunVES(state=get_sync_state())
+            else:
+                # Other processes create companies and upload media too
+                self._shotgun.clear_read_caches()
+            entries = stream_entries(Entry.objects.filter(id__in=ready))
+            for entry in entries:
+                phases = ready[entry.id]
+                logger.info(
+                    'Syncing %s phases %s' % (entry.entryNum, sorted(phases))
+                )
+                try:
+                    # Saves of people leave the entry's lastEdit as it was,
+                    # so the sync state can not tell what is already done
+                    if self._shotgun.sync_entry(
+                        entry, phases, skip_synced=False
+                    ):
+                        logger.error('Could not sync %s' % entry)
+                except Exception:
+                    logger.exception('Could not sync %s' % entry)
+        finally:
+            # This runs on the timer thread, which has its own connection
+            connection.close()
+
+
+coalescer = SyncCoalescer()
+
+
+def mark_changed(entry_id, phases):
+    """
+    Queue phases of an entry for syncing, for changes a save signal does
+    not see such as new media from the encode pipeline.
+    :param entry_id:
+    :param phases:
+    """
+    coalescer.add(entry_id, phases)
+
+
+def _field_value(instance, field):
+    # The attname, e.g. entryNum_id, so foreign keys are not fetched. Fields
+    # deferred by only() are not loaded just to be compared.
+    return instance.__dict__.get(Entry._meta.get_field(field).attname)
+
+
+def _snapshot(instance):
+    instance._shotgun_snapshot = dict(
+        (field, _field_value(instance, field)) for field in SYNC_FIELD_PHASES
+    )
+
+
+def entry_initialised(sender, instance, **kwargs):
+    _snapshot(instance)
+
+
+def entry_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    phases = set([PHASE_DETAILS])
+    snapshot = getattr(instance, '_shotgun_snapshot', {})
+    for field, field_phases in SYNC_FIELD_PHASES.items():
+        if snapshot.get(field) != _field_value(instance, field):
+            phases.update(field_phases)
+    _snapshot(instance)
+
+    coalescer.add(instance.id, phases)
+
+
+def person_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    fields = [
+        field for field in PERSON_FIELDS
+        if Entry._meta.get_field(field).related_model is sender
+    ]
+    if not fields:
+        return
+
+    query = Q()
+    for field in fields:
+        query |= Q(**{field: instance})
+
+    for entry_id in Entry.objects.filter(query).values_list('id', flat=True):
+        coalescer.add(entry_id, [PHASE_DETAILS])
+
+
+def connect_signals():
+    """
+    Sync entries to shotgun as they and their people are saved. Call this
+    from the app's ready().
+    """
+    if not settings.UPDATE_SHOTGUN:
+        logger.warning('Not updating Shotgun')
+        return
+
+    post_init.connect(
+        entry_initialised, sender=Entry,
+        dispatch_uid='shotgun_entry_initialised'
+    )
+    post_save.connect(
+        entry_saved, sender=Entry, dispatch_uid='shotgun_entry_saved'
+    )
+
+    person_models = set(
+        Entry._meta.get_field(field).related_model for field in PERSON_FIELDS
+    )
+    for person_model in person_models:
+        post_save.connect(
+            person_saved, sender=person_model,
+            dispatch_uid='shotgun_person_saved_%s' % person_model.__name__
+        )
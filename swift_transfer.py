@@ -0,0 +1,495 @@
+import contextlib
+import copy
+import errno
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+# Local cache of swift downloads, bounded to VES_SWIFT_CACHE_SIZE bytes.
+# The temp directory is often small, point VES_SWIFT_CACHE_DIR at a disk
+# of its own before raising the size.
+SWIFT_CACHE_DIR = getattr(
+    settings, 'VES_SWIFT_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'ves_swift_cache')
+)
+SWIFT_CACHE_SIZE = getattr(settings, 'VES_SWIFT_CACHE_SIZE', 2 * 1024 ** 3)
+
+# Files downloaded this recently are not evicted, so a new download is
+# not lost before it is pinned
+SWIFT_CACHE_GRACE_SECONDS = 600
+
+# Downloads read into chunks leased from a shared pool, so however many
+# transfers run at once they hold at most VES_SWIFT_BUFFER_MEMORY bytes
+CHUNK_SIZE = getattr(settings, 'VES_SWIFT_CHUNK_SIZE', 1024 * 1024 * 8)
+BUFFER_MEMORY = getattr(
+    settings, 'VES_SWIFT_BUFFER_MEMORY', 1024 * 1024 * 256
+)
+
+# Objects at least this big are fetched as byte ranges over several
+# connections, a single stream is limited by the round trip time
+DOWNLOAD_STREAMS = getattr(settings, 'VES_SWIFT_DOWNLOAD_STREAMS', 4)
+RANGE_SIZE = getattr(settings, 'VES_SWIFT_RANGE_SIZE', 1024 * 1024 * 64)
+PARALLEL_THRESHOLD = RANGE_SIZE * 2
+
+# Downloads that do not match their md5 are fetched again this many times
+VERIFY_ATTEMPTS = getattr(settings, 'VES_SWIFT_VERIFY_ATTEMPTS', 3)
+
+
+class TransferIntegrityError(Exception):
+    pass
+
+
+class BufferPool(object):
+    """
+    Memory budget for chunks in flight. Chunks are either reusable buffers
+    leased from the pool, or reservations of bytes for chunks something
+    else allocates. Both block while the budget is used up, which slows
+    readers down to the rate the writers free chunks instead of growing
+    memory. Idle buffers count against the budget and are dropped when a
+    reservation needs their room.
+    """
+
+    def __init__(self, budget=BUFFER_MEMORY, chunk_size=CHUNK_SIZE):
+        self.budget = budget
+        self.chunk_size = chunk_size
+        self._in_use = 0
+        self._free = []
+        self._condition = threading.Condition()
+
+    def _wait_for(self, size):
+        # Called with the condition held. One chunk may exceed the budget
+        # on its own.
+        while self._in_use + size + \
+                len(self._free) * self.chunk_size > self.budget:
+            if self._free:
+                self._free.pop()
+            elif self._in_use:
+                self._condition.wait()
+            else:
+                break
+        self._in_use += size
+
+    def lease(self):
+        """
+        :return: a chunk_size buffer, hand it back with release
+        """
+        with self._condition:
+            self._wait_for(self.chunk_size)
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.chunk_size)
+
+    def release(self, buf):
+        with self._condition:
+            self._in_use -= self.chunk_size
+            self._free.append(buf)
+            self._condition.notify_all()
+
+    def reserve(self, size):
+        """
+        Count size bytes, allocated by the caller, against the budget. Hand
+        them back with unreserve.
+        """
+        with self._condition:
+            self._wait_for(size)
+
+    def unreserve(self, size):
+        with self._condition:
+            self._in_use -= size
+            self._condition.notify_all()
+
+
+buffer_pool = BufferPool()
+
+
+def read_chunks(body, pool=None):
+    """
+    Iterate over a get_object body, made with resp_chunk_size=CHUNK_SIZE,
+    within the pool's budget. Bodies that support readinto are read into
+    pool buffers. Other bodies, such as swiftclient's, allocate their own
+    chunks, and those chunks reserve their size from the budget instead.
+    Each chunk is only valid until the next one is asked for.
+    :param body: swift response body
+    :param pool: BufferPool, the shared one by default
+    """
+    pool = pool or buffer_pool
+    readinto = getattr(body, 'readinto', None)
+    if readinto is None:
+        chunks = iter(body)
+        while True:
+            pool.reserve(pool.chunk_size)
+            try:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                yield chunk
+            finally:
+                pool.unreserve(pool.chunk_size)
+
+    while True:
+        buf = pool.lease()
+        try:
+            size = readinto(buf)
+            if not size:
+                return
+            yield memoryview(buf)[:size]
+        finally:
+            pool.release(buf)
+
+
+def _is_segmented(headers):
+    """
+    The ETag of a large object manifest is not the md5 of its content
+    """
+    return (
+        headers.get('x-static-large-object', '').lower() == 'true' or
+        'x-object-manifest' in headers
+    )
+
+
+def clone_connection(connection):
+    """
+    Connection with the same account and token but its own http connection,
+    swiftclient connections can not be shared between threads
+    """
+    clone = copy.copy(connection)
+    clone.http_conn = None
+    return clone
+
+
+def _hash_range(f, start, end, md5):
+    buf = buffer_pool.lease()
+    try:
+        view = memoryview(buf)
+        f.seek(start)
+        remaining = end + 1 - start
+        while remaining:
+            size = f.readinto(view[:min(remaining, len(buf))])
+            if not size:
+                raise TransferIntegrityError(
+                    'Bytes %s-%s missing from %s' % (start, end, f.name)
+                )
+            md5.update(view[:size])
+            remaining -= size
+    finally:
+        buffer_pool.release(buf)
+
+
+def _download_stream(connection, container, obj_name, path):
+    _, ob_contents = connection.get_object(
+        container, obj_name, resp_chunk_size=CHUNK_SIZE
+    )
+    md5 = hashlib.md5()
+    with open(path, 'wb') as f:
+        for chunk in read_chunks(ob_contents):
+            md5.update(chunk)
+            f.write(chunk)
+    return md5.hexdigest()
+
+
+def _download_ranges(connection, container, obj_name, path, size, streams):
+    range_size = min(RANGE_SIZE, -(-size // streams))
+    ranges = [
+        (start, min(start + range_size, size) - 1)
+        for start in range(0, size, range_size)
+    ]
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    local = threading.local()
+
+    def fetch(byte_range):
+        start, end = byte_range
+        if not hasattr(local, 'connection'):
+            local.connection = clone_connection(connection)
+        _, ob_contents = local.connection.get_object(
+            container, obj_name, resp_chunk_size=CHUNK_SIZE,
+            headers={'Range': 'bytes=%s-%s' % (start, end)}
+        )
+        # Each range writes through its own handle at its own offset
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            for chunk in read_chunks(ob_contents):
+                f.write(chunk)
+            if f.tell() != end + 1:
+                raise TransferIntegrityError(
+                    'Short read of %s/%s bytes %s-%s'
+                    % (container, obj_name, start, end)
+                )
+        return byte_range
+
+    md5 = hashlib.md5()
+    pool = ThreadPool(min(streams, len(ranges)))
+    try:
+        # imap hands back the ranges in order, each as soon as it and the
+        # ones before it are written, so hashing runs alongside the
+        # transfer and reads the ranges while they are in the page cache
+        with io.open(path, 'rb') as f:
+            for start, end in pool.imap(fetch, ranges):
+                _hash_range(f, start, end, md5)
+    finally:
+        pool.close()
+        pool.join()
+
+    return md5.hexdigest()
+
+
+def _verify(headers, container, obj_name, md5, expected_md5=None):
+    etag = headers.get('etag', '').strip('"')
+    if _is_segmented(headers):
+        etag = None
+    for expected in (etag, expected_md5):
+        if expected and md5 != expected:
+            raise TransferIntegrityError(
+                'md5 of %s/%s is %s, expected %s'
+                % (container, obj_name, md5, expected)
+            )
+
+
+def _with_verify_retries(fetch, container, obj_name):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return fetch()
+        except TransferIntegrityError as e:
+            if attempt >= VERIFY_ATTEMPTS:
+                raise
+            logger.warning('%s, fetching %s/%s again (attempt %s)'
+                           % (e, container, obj_name, attempt + 1))
+
+
+def read_object(connection, container, obj_name, expected_md5=None):
+    """
+    Read a small swift object, such as a thumbnail, into memory. It is
+    checked against the object's ETag and fetched again if it differs.
+    :param connection: swift connection
+    :param container:
+    :param obj_name:
+    :param expected_md5: md5 the contents must also have, if known
+    :return: the object's contents
+    """
+    def fetch():
+        headers, contents = connection.get_object(container, obj_name)
+        _verify(
+            headers, container, obj_name,
+            hashlib.md5(contents).hexdigest(), expected_md5
+        )
+        return contents
+
+    return _with_verify_retries(fetch, container, obj_name)
+
+
+def download_object(connection, container, obj_name, path, headers=None,
+                    streams=DOWNLOAD_STREAMS, expected_md5=None):
+    """
+    Download a swift object to path, large objects as parallel byte ranges.
+    The md5 is worked out as the bytes arrive and checked against the
+    object's ETag, a download that differs is fetched again and after
+    VERIFY_ATTEMPTS raises TransferIntegrityError.
+    :param connection: swift connection
+    :param container:
+    :param obj_name:
+    :param path:
+    :param headers: the object's headers if they have already been read
+    :param streams: number of connections to use for large objects
+    :param expected_md5: md5 the file must also have, if known
+    :return: md5 of the downloaded file
+    """
+    if headers is None:
+        headers = connection.head_object(container, obj_name)
+    size = int(headers.get('content-length', 0))
+
+    def fetch():
+        if streams > 1 and size >= PARALLEL_THRESHOLD:
+            md5 = _download_ranges(
+                connection, container, obj_name, path, size, streams
+            )
+        else:
+            md5 = _download_stream(connection, container, obj_name, path)
+        _verify(headers, container, obj_name, md5, expected_md5)
+        return md5
+
+    return _with_verify_retries(fetch, container, obj_name)
+
+
+def _utf8(value):
+    # Byte strings are hashed as they are, encoding them would decode them
+    # as ascii first on python 2
+    if isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class SwiftCache(object):
+    """
+    Size bounded, least recently used cache of swift objects on local disk.
+
+    Objects are keyed by container, name and ETag, so a changed object is
+    fetched again. Files appear atomically by link and are pinned with a
+    shared lock while in use, eviction skips pinned files and holds a lock
+    of its own, so any number of processes can share one cache directory.
+    """
+
+    def __init__(self, root=SWIFT_CACHE_DIR, max_size=SWIFT_CACHE_SIZE):
+        self.root = root
+        self.max_size = max_size
+
+    def path_for(self, container, obj_name, etag, filename=None):
+        key = hashlib.sha1(b'\n'.join(
+            _utf8(part) for part in (container, obj_name, etag, filename or '')
+        )).hexdigest()
+        return os.path.join(
+            self.root, key[:2], key, filename or os.path.basename(obj_name)
+        )
+
+    @contextlib.contextmanager
+    def pinned(self, connection, container, obj_name, filename=None):
+        """
+        Local copy of a swift object, downloading it on a miss. The file is
+        not evicted until the block ends, and belongs to the cache so must
+        not be changed or removed.
+        :param connection: swift connection
+        :param container:
+        :param obj_name:
+        :param filename: name for the local file, defaults to the object's
+        :return: path of the cached file
+        """
+        headers = connection.head_object(container, obj_name)
+        etag = headers.get('etag', '').strip('"')
+        path = self.path_for(container, obj_name, etag, filename)
+
+        downloaded = False
+        pin = self._pin(path)
+        while pin is None:
+            self._download(connection, container, obj_name, path, headers)
+            downloaded = True
+            pin = self._pin(path)
+
+        try:
+            if downloaded:
+                self.evict()
+            else:
+                # Mark as recently used
+                os.utime(path, None)
+            yield path
+        finally:
+            pin.close()
+
+    @contextlib.contextmanager
+    def _lock(self, operation):
+        # Cache wide lock, shared while adding files and exclusive while
+        # evicting
+        _makedirs(self.root)
+        with open(os.path.join(self.root, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            yield
+
+    def _pin(self, path):
+        # Open file holding a shared lock on path, None if it is not cached
+        try:
+            pin = open(path, 'rb')
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        fcntl.flock(pin, fcntl.LOCK_SH)
+        # Evicted between opening and locking
+        try:
+            cached = os.stat(path).st_ino == os.fstat(pin.fileno()).st_ino
+        except OSError:
+            cached = False
+        if not cached:
+            pin.close()
+            return None
+        return pin
+
+    def _download(self, connection, container, obj_name, path, headers):
+        directory = os.path.dirname(path)
+        # Under the cache lock so evict can not remove the directory before
+        # the partial file is in it. The name is unique to this download,
+        # another thread or process may be fetching the same object.
+        with self._lock(fcntl.LOCK_SH):
+            _makedirs(directory)
+            fd, partial_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        os.close(fd)
+        try:
+            download_object(
+                connection, container, obj_name, partial_path, headers
+            )
+            # Linked rather than renamed so a copy another download has
+            # already added, and may have pinned, is not replaced
+            try:
+                os.link(partial_path, path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.unlink(partial_path)
+
+    def evict(self):
+        """
+        Remove the least recently used files that are not pinned until the
+        cache fits
+        """
+        with self._lock(fcntl.LOCK_EX):
+            files = []
+            total = 0
+            for dir_path, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename == '.lock' or filename.endswith('.part'):
+                        continue
+                    path = os.path.join(dir_path, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            protected = time.time() - SWIFT_CACHE_GRACE_SECONDS
+            for mtime, size, path in sorted(files):
+                if total <= self.max_size or mtime > protected:
+                    break
+                if self._remove(path):
+                    total -= size
+
+    @staticmethod
+    def _remove(path):
+        # Called with the cache lock held. Pinned files are left for a
+        # later eviction.
+        try:
+            with open(path, 'rb') as cached_file:
+                fcntl.flock(cached_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.unlink(path)
+        except (IOError, OSError):
+            # Pinned or already gone
+            return False
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+        return True
+
+
+swift_cache = SwiftCache()
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+from django.conf import settings
+
+SYNC_STATE_PATH = getattr(settings, 'SHOTGUN_SYNC_STATE_PATH', None)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    entry_id INTEGER PRIMARY KEY,
+    last_edit TEXT,
+    submission_id INTEGER,
+    slate_hash TEXT,
+    user_ids TEXT
+);
+CREATE TABLE IF NOT EXISTS versions (
+    entry_id INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    md5 TEXT NOT NULL,
+    version_id INTEGER,
+    PRIMARY KEY (entry_id, phase, md5)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    entry_id INTEGER,
+    phase TEXT,
+    fingerprint TEXT
+);
+'''
+
+
+def entries_fingerprint(entry_ids):
+    """
+    :return: hash of a set of entry ids, a run only resumes over the same
+        entries it recorded its position for
+    """
+    return hashlib.sha1(
+        ','.join(str(entry_id) for entry_id in sorted(set(entry_ids)))
+        .encode('ascii')
+    ).hexdigest()
+
+
+class SyncStateStore(object):
+    """
+    Local record of what has been synced to shotgun, per entry: the
+    lastEdit its details were synced at, the submission id, the slate hash,
+    the user ids and the version id of each media md5. Runs also record the
+    entry and phase they are on so a crashed run can resume there.
+
+    Backed by SQLite, safe to share between threads and processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+        self._add_column('runs', 'fingerprint', 'TEXT')
+
+    def _add_column(self, table, column, column_type):
+        # Stores made before the column existed
+        columns = [
+            row['name']
+            for row in self._db.execute('PRAGMA table_info(%s)' % table)
+        ]
+        if column not in columns:
+            try:
+                with self._db:
+                    self._db.execute(
+                        'ALTER TABLE %s ADD COLUMN %s %s'
+                        % (table, column, column_type)
+                    )
+            except sqlite3.OperationalError:
+                # Added by another process meanwhile
+                pass
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            with self._db:
+                return self._db.execute(sql, params).fetchall()
+
+    def _upsert_entry(self, entry_id, **fields):
+        self._execute(
+            'INSERT OR IGNORE INTO entries (entry_id) VALUES (?)', (entry_id,)
+        )
+        assignments = ', '.join('%s = ?' % field for field in fields)
+        self._execute(
+            'UPDATE entries SET %s WHERE entry_id = ?' % assignments,
+            list(fields.values()) + [entry_id]
+        )
+
+    def get(self, entry_id):
+        """
+        :param entry_id:
+        :return: dict of the entry's state, None if it was never synced
+        """
+        rows = self._execute(
+            'SELECT * FROM entries WHERE entry_id = ?', (entry_id,)
+        )
+        if not rows:
+            return None
+        state = dict(zip(rows[0].keys(), rows[0]))
+        state['user_ids'] = json.loads(state['user_ids'] or '[]')
+        return state
+
+    def details_synced(self, entry_id, last_edit):
+        state = self.get(entry_id)
+        return state is not None and state['last_edit'] == str(last_edit)
+
+    def record_details(self, entry_id, last_edit, submission_id, user_ids):
+        self._upsert_entry(
+            entry_id,
+            last_edit=str(last_edit),
+            submission_id=submission_id,
+            user_ids=json.dumps(sorted(user_ids)),
+        )
+
+    def slate_hash(self, entry_id):
+        state = self.get(entry_id)
+        return state and state['slate_hash']
+
+    def record_slate_hash(self, entry_id, slate_hash):
+        self._upsert_entry(entry_id, slate_hash=slate_hash)
+
+    def version_id(self, entry_id, phase, md5):
+        rows = self._execute(
+            'SELECT version_id FROM versions '
+            'WHERE entry_id = ? AND phase = ? AND md5 = ?',
+            (entry_id, phase, md5)
+        )
+        return rows[0]['version_id'] if rows else None
+
+    def record_version(self, entry_id, phase, md5, version_id):
+        self._execute(
+            'INSERT OR REPLACE INTO versions '
+            '(entry_id, phase, md5, version_id) VALUES (?, ?, ?, ?)',
+            (entry_id, phase, md5, version_id)
+        )
+
+    def forget(self, entry_id):
+        """
+        Drop everything recorded for an entry so its next sync does it all
+        :param entry_id:
+        """
+        self._execute('DELETE FROM entries WHERE entry_id = ?', (entry_id,))
+        self._execute('DELETE FROM versions WHERE entry_id = ?', (entry_id,))
+
+    def forget_submissions(self, submission_ids):
+        """
+        Drop everything recorded for the entries of submissions deleted in
+        shotgun, so their next sync does it all again
+        :param submission_ids:
+        """
+        for submission_id in submission_ids:
+            for row in self._execute(
+                'SELECT entry_id FROM entries WHERE submission_id = ?',
+                (submission_id,)
+            ):
+                self.forget(row['entry_id'])
+
+    def forget_versions(self, version_ids):
+        """
+        Drop the record of versions deleted in shotgun, so their media is
+        synced again
+        :param version_ids:
+        """
+        for version_id in version_ids:
+            self._execute(
+                'DELETE FROM versions WHERE version_id = ?', (version_id,)
+            )
+
+    def run_position(self, name, fingerprint=None):
+        """
+        :param name: run name
+        :param fingerprint: entries_fingerprint of the run's entries
+        :return: (entry id, phase) the run was on, None if it finished or
+            was over different entries
+        """
+        rows = self._execute(
+            'SELECT entry_id, phase, fingerprint FROM runs WHERE name = ?',
+            (name,)
+        )
+        if not rows or rows[0]['fingerprint'] != fingerprint:
+            return None
+        return rows[0]['entry_id'], rows[0]['phase']
+
+    def set_run_position(self, name, entry_id, phase, fingerprint=None):
+        self._execute(
+            'INSERT OR REPLACE INTO runs (name, entry_id, phase, fingerprint) '
+            'VALUES (?, ?, ?, ?)',
+            (name, entry_id, phase, fingerprint)
+        )
+
+    def finish_run(self, name):
+        self._execute('DELETE FROM runs WHERE name = ?', (name,))
+
+
+def get_sync_state():
+    """
+    :return: SyncStateStore at SHOTGUN_SYNC_STATE_PATH, None if not set
+    """
+    if not SYNC_STATE_PATH:
+        return None
+    return SyncStateStore(SYNC_STATE_PATH)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from shotgun import DirectoryIndex, get_oldest_file, get_youngest_file
+
+
+class OldestFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.a = self._write('a')
+        self.b = self._write('b')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, name):
+        # ctimes need to differ by more than the filesystem's resolution
+        time.sleep(0.05)
+        path = os.path.join(self.path, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        return path
+
+    def test_oldest_and_youngest(self):
+        self.assertEqual(get_oldest_file([self.b, self.a]), self.a)
+        self.assertEqual(get_youngest_file([self.a, self.b]), self.b)
+        self.assertIsNone(get_oldest_file([]))
+
+    def test_rewritten_file(self):
+        index = DirectoryIndex(self.path)
+        self.assertEqual(index.oldest(), [self.a])
+
+        # Rewriting in place moves a's ctime on but not the directory's
+        self._write('a')
+
+        self.assertEqual(get_oldest_file([self.a, self.b]), self.b)
+        self.assertEqual(get_youngest_file([self.a, self.b]), self.a)
+        self.assertEqual(index.oldest(), [self.b])
+        self.assertEqual(index.youngest(2), [self.a, self.b])
+
+
+if __name__ == '__main__':
+    unittest.main()